@@ -1,16 +1,26 @@
+import os
+
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 def create_app():
     app = Flask(__name__)
+
+    # Behind a reverse proxy, take the client address from X-Forwarded-For so
+    # per-client limits don't lump every user together. Off unless configured:
+    # clients that connect directly could otherwise pick their own address.
+    trusted_proxies = int(os.getenv('TRUSTED_PROXIES', 0))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
     
     # Enable CORS with specific settings
     CORS(app, resources={
         r"/api/*": {
             "origins": ["http://localhost:5173"],
             "methods": ["GET", "POST", "OPTIONS"],
-            "allow_headers": ["Content-Type"],
-            "expose_headers": ["Content-Type"],
+            "allow_headers": ["Content-Type", "Range", "If-None-Match"],
+            "expose_headers": ["Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag"],
             "supports_credentials": True,
             "max_age": 120,
         }
@@ -1,42 +1,102 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, g, send_file
 import openai
 import os
+import io
+import json
+import hashlib
+import time
+import base64
 from dotenv import load_dotenv
 from ..services.search_service import SearchService
 from ..services.image_service import ImageService
-from google.cloud import texttospeech
-import base64
+from ..services.jobs import JobQueue, JobLimitExceeded, DONE, FAILED
+from ..services.cache import LRUCache, normalize_question
+from ..services.intent_router import IntentRouter, SMALL_TALK, RAG
+from ..services.metrics import metrics
+from ..services.audio_cache import AudioCache
+from ..services.tts_pipeline import SpeechStream, stitch_mp3
+from ..services.tts_service import TTSService
+from ..services.conversation import ConversationMemory
+from ..services.resilience import Deadline, DeadlineExceeded, circuit_breaker, breaker_stats
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 chat_bp = Blueprint('chat', __name__)
+CHAT_PARAMS = {"model": "gpt-3.5-turbo", "temperature": 0.7, "max_tokens": 500}
+# Time budgets (seconds): the whole chat request, and the caps for single upstream calls
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', 30))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 20))
+TTS_TIMEOUT = float(os.getenv('TTS_TIMEOUT', 15))
+IMAGE_DEADLINE = float(os.getenv('IMAGE_DEADLINE', 90))
+AUDIO_DEADLINE = float(os.getenv('AUDIO_DEADLINE', 60))
+# Longest ?wait= a job poll may block; each waiting poll holds a gunicorn thread
+MAX_POLL_WAIT = float(os.getenv('MAX_POLL_WAIT', 2))
+openai_breaker = circuit_breaker('openai')
+tts_breaker = circuit_breaker('tts')
+# Answers are tagged with the search index version, so index updates invalidate them
+answer_cache = LRUCache(
+    max_entries=int(os.getenv('ANSWER_CACHE_SIZE', 512)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600))
+)
+# Speech is synthesized in the background so chat answers don't wait for TTS
+audio_jobs = JobQueue(
+    max_workers=int(os.getenv('AUDIO_WORKERS', 2)),
+    ttl=float(os.getenv('AUDIO_JOB_TTL', 600)),
+    name='audio'
+)
+# Synthesized speech on disk, shared by all workers; repeated answers skip the TTS call
+audio_cache = AudioCache()
+# SDXL calls take 10-30 s; they run here instead of holding a request worker
+image_jobs = JobQueue(
+    max_workers=int(os.getenv('IMAGE_WORKERS', 2)),
+    ttl=float(os.getenv('IMAGE_JOB_TTL', 600)),
+    name='image',
+    max_per_owner=int(os.getenv('IMAGE_JOBS_PER_USER', 2))
+)
+# Generated images by content hash, served as PNG from /api/images/<id>
+image_store = LRUCache(
+    max_entries=int(os.getenv('IMAGE_STORE_SIZE', 32)),
+    ttl=float(os.getenv('IMAGE_STORE_TTL', 3600))
+)
+# Older conversation turns are summarized off the request path
+summary_jobs = JobQueue(max_workers=1, ttl=60, name='summary')
 try:
     search_service = SearchService()
     image_service = ImageService()
-    tts_client = texttospeech.TextToSpeechClient()
+    # Pooled clients, request coalescing and the audio cache for all speech
+    tts_service = TTSService(cache=audio_cache, timeout=TTS_TIMEOUT)
 except Exception as e:
     print(f"Warning: Service initialization failed: {str(e)}")
     search_service = None
     image_service = None
-    tts_client = None
+    tts_service = None
+# Decides before retrieval whether a message needs search and the LLM at all
+intent_router = IntentRouter(search_service)
+
+@chat_bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@chat_bp.after_request
+def record_request(response):
+    # For streams this is the time until the headers go out; see stream_duration_seconds
+    endpoint = request.endpoint or 'unknown'
+    if 'request_started' in g:
+        metrics.observe('request_duration_seconds', time.perf_counter() - g.request_started,
+                        help="Time to produce a response, per endpoint", endpoint=endpoint)
+    metrics.inc('requests_total', help="Requests per endpoint and status",
+                endpoint=endpoint, status=response.status_code)
+    return response
 
 def is_course_related(question, context):
     """
     Determine if a question is course-related based on context and keywords.
     """
-    # List of non-course keywords
-    general_keywords = [
-        'weather', 'time', 'hello', 'hi', 'hey', 
-        'how are you', 'what\'s up', 'good morning',
-        'good afternoon', 'good evening', 'thanks',
-        'thank you', 'bye', 'goodbye', 'who are you'
-    ]
-    
     question_lower = question.lower()
     
     # If question contains general keywords, it's not course-related
-    if any(keyword in question_lower for keyword in general_keywords):
+    if intent_router.general_keywords.search(question_lower):
         return False
     
     # If meaningful context was found, it's course-related
@@ -44,149 +104,643 @@ def is_course_related(question, context):
         meaningful_context = len(context.split()) > 10
         return meaningful_context
     
-    # List of course-specific keywords
-    course_keywords = [
-        'ptrs', 'muscle', 'neural', 'plasticity', 'motor unit', 
-        'metabolism', 'epigenetics', 'rehabilitation', 'spinal cord',
-        'biomechanics', 'motor control', 'hill equation', 'exercise',
-        'physical therapy', 'movement', 'strength training',
-        'fitness', 'anatomy', 'physiology', 'health', 'medical',
-        'patient', 'treatment', 'therapy', 'clinical', 'research',
-        'lecture', 'course', 'exam', 'assignment', 'study'
-    ]
-    
-    return any(keyword in question_lower for keyword in course_keywords)
+    return bool(intent_router.course_keywords.search(question_lower))
+
+def cached_audio(text):
+    # Hits are counted by the cache itself (ptrs_audio_cache_hits_total)
+    return audio_cache.get(tts_service.cache_key(text))
+
+def retrieve_context(user_message, scoring=None):
+    search_result = {'context': "", 'sources': []}
+    if search_service:
+        try:
+            print("Searching for relevant content...")
+            with metrics.span('retrieval'):
+                search_result = search_service.get_context(user_message, scoring=scoring)
+            print(f"Found context: {bool(search_result['context'])}")
+            if search_result['sources']:
+                print(f"Source: {search_result['sources'][0]['filename']}")
+        except Exception as e:
+            print(f"Search service error: {str(e)}")
+    else:
+        print("Search service not initialized!")
+    return search_result
+
+def route_message(user_message, scoring=None):
+    """Route the message, then retrieve context only when it takes the RAG path"""
+    with metrics.span('route'):
+        routing = intent_router.route(user_message)
+    metrics.inc('routes_total', help="Chat messages per route", route=routing['route'])
+    print(f"Route: {routing['route']} (index score {routing['score']:.2f})")
+    if routing['route'] == RAG:
+        search_result = retrieve_context(user_message, scoring)
+        # Check if question is course-related
+        with metrics.span('classification'):
+            is_course_question = is_course_related(user_message, search_result['context'])
+    else:
+        search_result = {'context': "", 'sources': []}
+        is_course_question = False
+    print(f"Is course-related question: {is_course_question}")
+    return routing, search_result, is_course_question
+
+def answer_cache_key(user_message, search_result, is_course_question, history):
+    # The same question over the same retrieved chunks and history gets the same prompt
+    return (
+        normalize_question(user_message),
+        tuple(sorted(CHAT_PARAMS.items())),
+        search_result.get('fingerprint'),
+        is_course_question,
+        ConversationMemory.fingerprint(history)
+    )
+
+def build_messages(user_message, context, is_course_question, history=None):
+    # Create system message
+    system_message = (
+        "You are a knowledgeable teaching assistant for the PTRS:6224 course. "
+    )
+    if context and is_course_question:
+        system_message += f"\nUse this course material to answer: {context}"
+    elif is_course_question:
+        system_message += "\nAnswer based on general knowledge about this topic in physical therapy and rehabilitation science."
+    else:
+        system_message = "You are a helpful assistant. Provide a general response as this question is not related to the course material."
+
+    messages = [{"role": "system", "content": system_message}]
+    if history:
+        if history['summary']:
+            messages[0]["content"] += f"\nSummary of the earlier conversation: {history['summary']}"
+        for question, answer in history['turns']:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def synthesize_audio(progress, text):
+    # The content key doubles as ETag of the finished MP3
+    etag = tts_service.cache_key(text)
+    audio = cached_audio(text)
+    if audio:
+        print("Audio cache hit")
+        return {"audio": audio, "etag": etag}
+    tts_breaker.check()
+    ready = []
+
+    def publish_segment(index, count, audio):
+        # Let pollers play the finished start of the answer while the rest is synthesized
+        ready.append(audio)
+        progress({
+            "segments_ready": index + 1,
+            "segments": count,
+            "audio": stitch_mp3(ready)
+        })
 
-def generate_audio(text):
     try:
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-        
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="en-US",
-            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
-        )
-        
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
-        
-        response = tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
-        
-        audio_base64 = base64.b64encode(response.audio_content).decode('utf-8')
-        return audio_base64
-        
+        with metrics.span('tts'):
+            audio = tts_service.synthesize_text(text, publish_segment, Deadline(AUDIO_DEADLINE))
     except Exception as e:
         print(f"Error generating audio: {str(e)}")
+        audio = None
+    if not audio:
+        tts_breaker.record_failure()
+        raise RuntimeError("Failed to generate audio")
+    tts_breaker.record_success()
+    print("Audio generated successfully")
+    return {"audio": audio, "etag": etag}
+
+def start_audio_job(message_content, audio_requested, degraded):
+    # Queue audio if requested; the client fetches it from /api/audio/<id>
+    if audio_requested and tts_service and message_content:
+        if not tts_breaker.is_available() and not audio_cache.contains(tts_service.cache_key(message_content)):
+            # Answer without audio while TTS is down
+            degraded.append('audio_unavailable')
+            return None
+        print("Queueing audio response...")
+        return audio_jobs.submit_with_progress(synthesize_audio, message_content)
+    return None
+
+def open_speech_stream(stream_audio, degraded, deadline):
+    # Speech that follows the streamed answer; None when not requested or TTS is down
+    if not (stream_audio and tts_service):
         return None
+    # allow() lets a half-open breaker send just one probe stream; close_speech_stream reports back
+    if not tts_breaker.allow():
+        degraded.append('audio_unavailable')
+        return None
+    return SpeechStream(tts_service.pipeline, deadline=deadline)
+
+def close_speech_stream(speech, message_content, degraded):
+    if speech.error:
+        tts_breaker.record_failure()
+        degrade(degraded, 'audio_interrupted', speech.error)
+    elif speech.segments:
+        tts_breaker.record_success()
+        # Later requests for the same answer (e.g. via /api/chat) then hit the audio cache
+        try:
+            audio_cache.put(tts_service.cache_key(message_content), speech.audio())
+        except OSError as e:
+            print(f"Error caching audio: {str(e)}")
+
+def complete_chat(messages, deadline, stream=False, **params):
+    """
+    Call the chat model within the request deadline. Raises
+    UpstreamUnavailable when the circuit is open or no time is left. Streams
+    report their outcome to the breaker themselves once they are consumed.
+    params override CHAT_PARAMS.
+    """
+    openai_breaker.check()
+    try:
+        response = openai.ChatCompletion.create(
+            messages=messages,
+            stream=stream,
+            request_timeout=deadline.timeout(OPENAI_TIMEOUT),
+            **dict(CHAT_PARAMS, **params)
+        )
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    if not stream:
+        openai_breaker.record_success()
+    return response
+
+def summarize_conversation(summary, turns):
+    """Fold older turns into the rolling summary of a conversation (runs on summary_jobs)"""
+    transcript = "\n".join(f"Student: {question}\nAssistant: {answer}" for question, answer in turns)
+    messages = [
+        {"role": "system", "content": (
+            "Summarize this conversation between a student and the PTRS:6224 teaching assistant "
+            f"in at most {conversation_memory.summary_tokens // 2} words. Keep the topics, facts and "
+            "open questions that later questions may refer to."
+        )},
+        {"role": "user", "content": f"Summary so far: {summary or '(none)'}\n\nNew turns:\n{transcript}"}
+    ]
+    with metrics.span('summarize'):
+        response = complete_chat(messages, Deadline(OPENAI_TIMEOUT), temperature=0.2,
+                                 max_tokens=conversation_memory.summary_tokens)
+    return response.choices[0].message.content
+
+# Server-side history per session_id, bounded to a fixed number of prompt tokens
+conversation_memory = ConversationMemory(summarize=summarize_conversation, jobs=summary_jobs)
+
+def remember_turn(session_id, user_message, message_content, routing, degraded):
+    # Canned replies and fallback answers would only use up the history budget
+    if routing['route'] != SMALL_TALK and 'llm_unavailable' not in degraded:
+        conversation_memory.append(session_id, user_message, message_content)
+
+def fallback_answer(context):
+    """Degraded answer when the chat model can't be reached: the retrieved material itself"""
+    if context:
+        return ("I can't reach the language model right now, so here is the most relevant "
+                f"course material I found:\n\n{context[:1500]}")
+    return "I can't answer right now because the language model is unavailable. Please try again in a moment."
+
+def degrade(degraded, reason, error):
+    print(f"Degraded response ({reason}): {str(error)}")
+    degraded.append(reason)
+    metrics.inc('degraded_responses_total', help="Responses served in a degraded mode", reason=reason)
+
+def response_metadata(search_result, is_course_question):
+    # Only include sources and context if it's a course-related question
+    context, sources = search_result['context'], search_result['sources']
+    return {
+        "sources": sources[0] if (sources and is_course_question) else None,
+        "used_context": bool(context) and is_course_question,
+        "context_preview": context[:200] if (context and is_course_question) else None,
+        "context_tokens": search_result.get('tokens') if (context and is_course_question) else None,
+        "is_course_related": is_course_question
+    }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_event_stream():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/event-stream'])
+    return best == 'text/event-stream'
 
 @chat_bp.route('/api/chat', methods=['POST'])
 def chat():
+    if wants_event_stream():
+        return chat_stream()
+
     try:
         data = request.get_json()
         user_message = data.get('message')
         audio_requested = data.get('audio_requested', False)
+        scoring = data.get('scoring')  # Optional per-request ranking override: cosine, bm25, bm25+
+        session_id = data.get('session_id') or ConversationMemory.new_session_id()
         print(f"\nReceived question: {user_message}")
+        deadline = Deadline(CHAT_DEADLINE)
+        degraded = []
         
-        context = ""
-        sources = []
-        if search_service:
-            try:
-                print("Searching for relevant content...")
-                search_result = search_service.get_context(user_message)
-                context = search_result['context']
-                sources = search_result['sources']
-                print(f"Found context: {bool(context)}")
-                if sources:
-                    print(f"Source: {sources[0]['filename']}")
-            except Exception as e:
-                print(f"Search service error: {str(e)}")
-        else:
-            print("Search service not initialized!")
+        routing, search_result, is_course_question = route_message(user_message, scoring)
+        context = search_result['context']
+        history = conversation_memory.history(session_id)
         
-        # Check if question is course-related
-        is_course_question = is_course_related(user_message, context)
-        print(f"Is course-related question: {is_course_question}")
-        
-        # Create system message
-        system_message = (
-            "You are a knowledgeable teaching assistant for the PTRS:6224 course. "
-        )
-        if context and is_course_question:
-            system_message += f"\nUse this course material to answer: {context}"
-        elif is_course_question:
-            system_message += "\nAnswer based on general knowledge about this topic in physical therapy and rehabilitation science."
+        cache_key = answer_cache_key(user_message, search_result, is_course_question, history)
+        version = search_result.get('index_version')
+        if routing['route'] == SMALL_TALK:
+            message_content, cached = routing['reply'], False
         else:
-            system_message = "You are a helpful assistant. Provide a general response as this question is not related to the course material."
-        
-        # Get response from OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        message_content = response.choices[0].message.content
-        
-        # Generate audio if requested
-        audio_base64 = None
-        if audio_requested and tts_client:
+            message_content = answer_cache.get(cache_key, version)
+            cached = message_content is not None
+        if cached:
+            print("Answer cache hit")
+        elif message_content is None:
             try:
-                print("Generating audio response...")
-                audio_base64 = generate_audio(message_content)
-                if audio_base64:
-                    print("Audio generated successfully")
-                else:
-                    print("Failed to generate audio")
+                # Get response from OpenAI
+                with metrics.span('llm'):
+                    response = complete_chat(
+                        build_messages(user_message, context, is_course_question, history), deadline
+                    )
+                
+                message_content = response.choices[0].message.content
+                answer_cache.put(cache_key, message_content, version)
             except Exception as e:
-                print(f"Error generating audio: {str(e)}")
+                degrade(degraded, 'llm_unavailable', e)
+                message_content = fallback_answer(context if is_course_question else "")
         
-        # Only include sources and context if it's a course-related question
-        return jsonify({
-            "message": message_content,
-            "sources": sources[0] if (sources and is_course_question) else None,
-            "used_context": bool(context) and is_course_question,
-            "context_preview": context[:200] if (context and is_course_question) else None,
-            "is_course_related": is_course_question,
-            "audio": audio_base64
-        })
+        remember_turn(session_id, user_message, message_content, routing, degraded)
+        audio_id = start_audio_job(message_content, audio_requested, degraded)
+        with metrics.span('serialize'):
+            return jsonify({
+                "message": message_content,
+                **response_metadata(search_result, is_course_question),
+                "session_id": session_id,
+                "history_tokens": history['tokens'],
+                "route": routing['route'],
+                "cached": cached,
+                "degraded": degraded,
+                "audio_id": audio_id
+            })
     
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@chat_bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Server-Sent Events variant of /api/chat. Emits a `sources` event as soon as
+    retrieval is done, a `token` event per generated delta and a final `done`
+    event with the usual response fields plus timings (time to first token and
+    total time, both in ms since the request arrived). Audio is queued as for
+    /api/chat, or, with "stream_audio": true, synthesized sentence by sentence
+    while the answer is generated and sent in order as `audio` events (base64
+    MP3 segments that play back to back).
+    """
+    started = time.perf_counter()
+    data = request.get_json()
+    user_message = data.get('message')
+    audio_requested = data.get('audio_requested', False)
+    stream_audio = data.get('stream_audio', False)
+    scoring = data.get('scoring')
+    session_id = data.get('session_id') or ConversationMemory.new_session_id()
+    print(f"\nReceived question (streaming): {user_message}")
+    deadline = Deadline(CHAT_DEADLINE)
+    degraded = []
+
+    def generate():
+        speech = None
+        first_audio_ms = None
+
+        def spoken(segments):
+            nonlocal first_audio_ms
+            for index, audio in segments:
+                if first_audio_ms is None:
+                    first_audio_ms = (time.perf_counter() - started) * 1000
+                    metrics.observe('stage_duration_seconds', first_audio_ms / 1000, stage='tts_first_audio')
+                yield sse_event('audio', {"index": index, "audio": base64.b64encode(audio).decode('utf-8')})
+
+        try:
+            routing, search_result, is_course_question = route_message(user_message, scoring)
+            context = search_result['context']
+            history = conversation_memory.history(session_id)
+            metadata = response_metadata(search_result, is_course_question)
+            retrieval_ms = (time.perf_counter() - started) * 1000
+            yield sse_event('sources', {
+                "sources": metadata['sources'],
+                "is_course_related": is_course_question,
+                "route": routing['route'],
+                "session_id": session_id
+            })
+            speech = open_speech_stream(stream_audio, degraded, deadline)
+
+            cache_key = answer_cache_key(user_message, search_result, is_course_question, history)
+            version = search_result.get('index_version')
+            if routing['route'] == SMALL_TALK:
+                message_content, cached = routing['reply'], False
+            else:
+                message_content = answer_cache.get(cache_key, version)
+                cached = message_content is not None
+            if message_content is not None:
+                # Canned and cached answers go out as a single delta
+                if cached:
+                    print("Answer cache hit")
+                first_token_ms = (time.perf_counter() - started) * 1000
+                yield sse_event('token', {"delta": message_content})
+                if speech:
+                    yield from spoken(speech.feed(message_content))
+            else:
+                first_token_ms = None
+                llm_started = time.perf_counter()
+                parts = []
+                streaming = False
+                try:
+                    completion = complete_chat(
+                        build_messages(user_message, context, is_course_question, history), deadline, stream=True
+                    )
+                    streaming = True
+                    for chunk in completion:
+                        if deadline.expired():
+                            raise DeadlineExceeded(f"Request deadline of {CHAT_DEADLINE:.0f}s exceeded")
+                        delta = chunk.choices[0].delta.get('content')
+                        if not delta:
+                            continue
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - started) * 1000
+                            metrics.observe('stage_duration_seconds', time.perf_counter() - llm_started,
+                                            stage='llm_first_token')
+                        parts.append(delta)
+                        yield sse_event('token', {"delta": delta})
+                        if speech:
+                            yield from spoken(speech.feed(delta))
+                    openai_breaker.record_success()
+                except Exception as e:
+                    if streaming:
+                        openai_breaker.record_failure()
+                    if parts:
+                        # Keep what was already sent; the answer just ends early
+                        degrade(degraded, 'llm_interrupted', e)
+                    else:
+                        degrade(degraded, 'llm_unavailable', e)
+                        parts.append(fallback_answer(context if is_course_question else ""))
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        yield sse_event('token', {"delta": parts[-1]})
+                        if speech:
+                            yield from spoken(speech.feed(parts[-1]))
+
+                message_content = "".join(parts)
+                metrics.observe('stage_duration_seconds', time.perf_counter() - llm_started, stage='llm_stream')
+                # Audio trouble doesn't make the text answer any less valid
+                if message_content and not any(reason.startswith('llm_') for reason in degraded):
+                    answer_cache.put(cache_key, message_content, version)
+
+            remember_turn(session_id, user_message, message_content, routing, degraded)
+            if speech:
+                yield from spoken(speech.finish())
+                close_speech_stream(speech, message_content, degraded)
+                audio_id = None
+            else:
+                audio_id = start_audio_job(message_content, audio_requested, degraded)
+            total_ms = (time.perf_counter() - started) * 1000
+            print(f"Streamed response: first token {first_token_ms or 0:.0f} ms, total {total_ms:.0f} ms")
+            metrics.observe('stream_duration_seconds', total_ms / 1000,
+                            help="Time from request to the end of a chat stream")
+            yield sse_event('done', {
+                "message": message_content,
+                **metadata,
+                "session_id": session_id,
+                "history_tokens": history['tokens'],
+                "route": routing['route'],
+                "cached": cached,
+                "degraded": degraded,
+                "audio_id": audio_id,
+                "audio_segments": len(speech.segments) if speech else None,
+                "timings": {
+                    "retrieval_ms": retrieval_ms,
+                    "first_token_ms": first_token_ms,
+                    "first_audio_ms": first_audio_ms,
+                    "total_ms": total_ms
+                }
+            })
+
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            metrics.inc('stream_errors_total', help="Chat streams that ended with an error event")
+            yield sse_event('error', {"error": str(e)})
+        finally:
+            # Client gone or stream failed: don't synthesize segments nobody will hear
+            if speech:
+                speech.cancel()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Keep reverse proxies from buffering the whole stream
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def binary_response(data, mimetype, etag, max_age, private=False):
+    """
+    Raw bytes with Content-Length, ETag and Range support: If-None-Match
+    gets a 304 and Range requests a 206 with just the requested bytes.
+    """
+    response = send_file(io.BytesIO(data), mimetype=mimetype, conditional=True, etag=etag, max_age=max_age)
+    if private:
+        response.cache_control.public = False
+        response.cache_control.private = True
+    return response
+
+@chat_bp.route('/api/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """
+    Poll a speech job started by /api/chat. Returns 202 while it is running
+    (?wait=<seconds>, at most MAX_POLL_WAIT, waits for it to finish first),
+    the URL of the MP3 once it is done
+    and 404 for unknown or expired ids. While running, "url" is set as soon
+    as the first segments are synthesized; it then serves that playable
+    prefix.
+    """
+    wait = min(request.args.get('wait', 0, type=float), MAX_POLL_WAIT)
+    job = audio_jobs.get(audio_id, wait=wait)
+    if job is None:
+        return jsonify({"error": "Unknown audio id"}), 404
+    if job['status'] == FAILED:
+        return jsonify({"status": job['status'], "error": job['error']}), 500
+    url = f"/api/audio/{audio_id}/mp3"
+    if job['status'] != DONE:
+        progress = job['progress'] or {}
+        return jsonify({
+            "status": job['status'],
+            "segments_ready": progress.get('segments_ready', 0),
+            "segments": progress.get('segments'),
+            "url": url if progress.get('audio') else None
+        }), 202
+    return jsonify({"status": job['status'], "url": url, "size": len(job['result']['audio'])})
+
+@chat_bp.route('/api/audio/<audio_id>/mp3', methods=['GET'])
+def get_audio_file(audio_id):
+    """
+    The MP3 of a speech job as audio/mpeg. Before the job is done this is
+    the prefix synthesized so far (not cacheable), or 202 if there is none.
+    """
+    job = audio_jobs.get(audio_id)
+    if job is None:
+        return jsonify({"error": "Unknown audio id"}), 404
+    if job['status'] == FAILED:
+        return jsonify({"status": job['status'], "error": job['error']}), 500
+    if job['status'] == DONE:
+        result = job['result']
+        return binary_response(result['audio'], 'audio/mpeg', result['etag'], audio_jobs.ttl, private=True)
+    progress = job['progress'] or {}
+    if not progress.get('audio'):
+        return jsonify({"status": job['status']}), 202
+    response = binary_response(progress['audio'], 'audio/mpeg',
+                               f"{audio_id}-{progress['segments_ready']}", None)
+    response.cache_control.no_store = True
+    return response
+
+@chat_bp.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """A generated image as image/png; ids are content hashes, so responses never change"""
+    image = image_store.get(image_id)
+    if image is None:
+        return jsonify({"error": "Unknown image id"}), 404
+    response = binary_response(image, 'image/png', image_id, 365 * 24 * 3600)
+    response.cache_control.immutable = True
+    return response
+
+def render_image(prompt):
+    """Image job: generate, store under the content hash and describe"""
+    with metrics.span('image_generation'):
+        image = image_service.generate_image(prompt, Deadline(IMAGE_DEADLINE))
+    if not image:
+        raise RuntimeError("Failed to generate image")
+    image_id = hashlib.sha256(image).hexdigest()
+    image_store.put(image_id, image)
+    
+    # Add descriptive information
+    description = f"Generated anatomical illustration showing {prompt}. "
+    description += "This medical-style diagram includes detailed labeling and precise anatomical structures. "
+    description += "You can use this illustration for studying or reference purposes."
+    return {
+        "image_id": image_id,
+        "image_url": f"/api/images/{image_id}",
+        "description": description
+    }
+
+def image_job_response(job_id, job):
+    """JSON body and status code describing an image job"""
+    body = {"job_id": job_id, "status": job['status']}
+    if job['status'] == DONE:
+        return dict(body, **job['result'], success=True), 200
+    if job['status'] == FAILED:
+        return dict(body, error=job['error'], success=False), 500
+    if 'position' in job:
+        body["position"] = job['position']
+    if job.get('started'):
+        body["running_seconds"] = round(time.time() - job['started'], 1)
+    return body, 202
+
 @chat_bp.route('/api/generate-image', methods=['POST'])
 def generate_image():
+    """
+    Queue an image and return 202 with its job id right away; poll
+    /api/image-jobs/<id> for the result. Each client may have
+    IMAGE_JOBS_PER_USER images in progress; more get 429.
+    """
     try:
         data = request.get_json()
         prompt = data.get('prompt')
+        if not prompt:
+            return jsonify({"error": "No prompt provided", "success": False}), 400
         
-        image_base64 = image_service.generate_image(prompt)
-        
-        # Add descriptive information
-        description = f"Generated anatomical illustration showing {prompt}. "
-        description += "This medical-style diagram includes detailed labeling and precise anatomical structures. "
-        description += "You can use this illustration for studying or reference purposes."
-        
-        if image_base64:
+        if not image_service or not image_service.breaker.is_available():
+            print("Image generation unavailable: stability circuit open")
+            metrics.inc('degraded_responses_total', help="Responses served in a degraded mode",
+                        reason='image_unavailable')
             return jsonify({
-                "image": image_base64,
-                "description": description,
-                "success": True
-            })
-        else:
-            return jsonify({
-                "error": "Failed to generate image",
+                "error": "Image generation is temporarily unavailable, please try again later",
+                "success": False,
+                "degraded": ["image_unavailable"]
+            }), 503
+        
+        try:
+            # No accounts here, so the client address stands in for the user
+            # (the real one behind a proxy, see TRUSTED_PROXIES in create_app)
+            job_id = image_jobs.submit_for(request.remote_addr, render_image, prompt)
+        except JobLimitExceeded as e:
+            print(f"Image job rejected: {str(e)}")
+            response = jsonify({
+                "error": "Too many images in progress, please wait for one to finish",
                 "success": False
-            }), 500
+            })
+            response.headers['Retry-After'] = '10'
+            return response, 429
+        
+        print(f"Queued image job {job_id} for prompt: {prompt}")
+        return jsonify({
+            "job_id": job_id,
+            "status": "pending",
+            "status_url": f"/api/image-jobs/{job_id}"
+        }), 202
             
     except Exception as e:
         print(f"Error in generate_image endpoint: {str(e)}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@chat_bp.route('/api/image-jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """
+    Poll an image job: 202 with queue position or running time while it is
+    in progress, 200 with image_url once done, 500 if it failed and 404 for
+    unknown or expired ids. ?wait=<seconds> (at most MAX_POLL_WAIT) waits for
+    the job to finish first; clients poll again after a short delay.
+    """
+    wait = min(request.args.get('wait', 0, type=float), MAX_POLL_WAIT)
+    job = image_jobs.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"error": "Unknown image job"}), 404
+    body, status = image_job_response(job_id, job)
+    return jsonify(body), status
+
+@chat_bp.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "query_cache": search_service.query_cache.stats() if search_service else None,
+        "answer_cache": answer_cache.stats(),
+        "audio_jobs": audio_jobs.stats(),
+        "image_jobs": image_jobs.stats(),
+        "breakers": breaker_stats(),
+        "conversations": conversation_memory.stats(),
+        "audio_cache": audio_cache.stats(),
+        "tts": tts_service.stats() if tts_service else None,
+        "stages": metrics.summary()
+    })
+
+# Stats fields that only ever grow; exported as <prefix>_<field>_total counters
+CACHE_COUNTERS = ('hits', 'misses', 'evictions', 'expirations', 'invalidations')
+JOB_COUNTERS = ('submitted', 'completed', 'failed', 'rejected')
+AUDIO_CACHE_COUNTERS = ('hits', 'misses', 'writes', 'evictions')
+
+def split_stats(prefix, stats, counter_fields, gauges, counters, labels=None):
+    """File each stats field under gauges or counters (as <prefix>_<field>_total)"""
+    for field, value in stats.items():
+        if field in counter_fields:
+            target, name = counters, f"{prefix}_{field}_total"
+        else:
+            target, name = gauges, f"{prefix}_{field}"
+        if labels is None:
+            target[name] = value
+        else:
+            target.setdefault(name, []).append((labels, value))
+
+@chat_bp.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    gauges, counters = {}, {}
+    caches = {'answer': answer_cache}
+    if search_service:
+        caches['query'] = search_service.query_cache
+    for cache_name, cache in caches.items():
+        split_stats('cache', cache.stats(), CACHE_COUNTERS, gauges, counters, {'cache': cache_name})
+    split_stats('audio_jobs', audio_jobs.stats(), JOB_COUNTERS, gauges, counters)
+    split_stats('image_jobs', image_jobs.stats(), JOB_COUNTERS, gauges, counters)
+    audio_cache_stats = audio_cache.stats()
+    audio_cache_fields = {field: audio_cache_stats[field] or 0 for field in ('bytes',) + AUDIO_CACHE_COUNTERS}
+    split_stats('audio_cache', audio_cache_fields, AUDIO_CACHE_COUNTERS, gauges, counters)
+    for upstream, breaker in breaker_stats().items():
+        gauges.setdefault('breaker_open', []).append(({'upstream': upstream}, breaker['state'] != 'closed'))
+        counters.setdefault('breaker_trips_total', []).append(({'upstream': upstream}, breaker['trips']))
+    return Response(metrics.render(gauges, counters), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+EXTENSIONS = {'MP3': '.mp3', 'OGG_OPUS': '.ogg', 'LINEAR16': '.wav'}
+
+
+class AudioCache:
+    """
+    Content-addressed disk cache for synthesized speech.
+
+    Files are named after a SHA-256 of (text, language, voice, encoding), so
+    the same answer spoken with the same voice always maps to the same file
+    and every worker process sharing the directory shares the cache. Writes
+    go to a temporary file in the target directory and are renamed into
+    place, so readers never see a partial file.
+
+    The directory is kept under max_bytes by deleting the least recently used
+    files (oldest mtime; hits touch their file). Each process tracks a running
+    estimate of the size and only rescans the directory when the estimate
+    crosses the cap, down to low_water * max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, low_water=0.9):
+        self.directory = directory or os.getenv('AUDIO_CACHE_DIR', './data/audio_cache')
+        self.max_bytes = int(os.getenv('AUDIO_CACHE_MAX_BYTES', 256 * 1024 * 1024)) if max_bytes is None else max_bytes
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(text, language, voice, encoding):
+        payload = "\0".join((text, language, voice, encoding))
+        return f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}{EXTENSIONS.get(encoding, '')}"
+
+    def path(self, key):
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def contains(self, key):
+        return self.max_bytes > 0 and os.path.exists(self.path(key))
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        if self.max_bytes <= 0:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing, or evicted by another worker between open and utime
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except Exception:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            self.writes += 1
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data)
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, name, stat
+
+    def _scan_size(self):
+        return sum(stat.st_size for _, name, stat in self._files() if not name.startswith('.tmp-'))
+
+    def evict(self):
+        """Delete least recently used files until the cache is under low_water * max_bytes"""
+        files = sorted(
+            ((stat.st_mtime, stat.st_size, path) for path, name, stat in self._files()
+             if not name.startswith('.tmp-')),
+        )
+        size = sum(entry[1] for entry in files)
+        target = self.max_bytes * self.low_water
+        evicted = 0
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            try:
+                os.unlink(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            # Gone either way; another worker may have evicted it first
+            size -= file_size
+        with self.lock:
+            self.size = size
+            self.evictions += evicted
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'directory': self.directory,
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions
+            }
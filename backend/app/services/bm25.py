@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import sparse
+
+
+class BM25Scorer:
+    """
+    Okapi BM25 / BM25+ over a chunk×term count matrix (CSC input is used as
+    is, without copying).
+
+    Chunk lengths relative to the average length are computed once; the
+    per-chunk denominators k1 * (1 - b + b * len / avglen) are cached for each
+    (k1, b) pair, so a query is a single vectorized pass over the posting lists
+    of its terms.
+    """
+
+    def __init__(self, term_counts, chunk_lengths=None):
+        postings = sparse.csc_matrix(term_counts)
+        postings.sort_indices()
+        self.n_docs = postings.shape[0]
+        self.indptr = postings.indptr
+        self.doc_ids = postings.indices
+        self.term_freqs = postings.data
+
+        if chunk_lengths is None:
+            chunk_lengths = np.asarray(term_counts.sum(axis=1)).ravel()
+        chunk_lengths = np.asarray(chunk_lengths, dtype=np.float64)
+        average_length = chunk_lengths.mean() if chunk_lengths.size else 0.0
+        self.relative_lengths = chunk_lengths / average_length if average_length > 0 else np.ones_like(chunk_lengths)
+
+        doc_freqs = np.diff(self.indptr)
+        # Lucene-style IDF, never negative even for terms in most chunks
+        self.idf = np.log1p((self.n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        self._norms = {}
+        self._weights = {}
+
+    def length_norms(self, k1, b):
+        key = (k1, b)
+        if key not in self._norms:
+            self._norms[key] = k1 * (1.0 - b + b * self.relative_lengths)
+        return self._norms[key]
+
+    def top_k(self, query_counts, k, k1=1.2, b=0.75, delta=0.0):
+        """
+        Return (doc_indices, scores) of the k best chunks for a 1×V query count
+        vector, best first. delta > 0 gives BM25+.
+        """
+        empty = np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        query_counts = sparse.csr_matrix(query_counts)
+        terms = query_counts.indices
+        if k <= 0 or not terms.size:
+            return empty
+
+        starts, ends = self.indptr[terms], self.indptr[terms + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return empty
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        docs = self.doc_ids[positions]
+        term_freqs = self.term_freqs[positions]
+        term_weights = np.repeat(query_counts.data * self.idf[terms], lengths)
+
+        norms = self.length_norms(k1, b)[docs]
+        contributions = term_weights * (term_freqs * (k1 + 1.0) / (term_freqs + norms) + delta)
+
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        candidate_scores = np.bincount(inverse, weights=contributions, minlength=candidates.size)
+
+        if candidates.size > k:
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+        else:
+            top = np.arange(candidates.size)
+        top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+        return candidates[top], candidate_scores[top]
+
+    def weights(self, k1, b, delta=0.0):
+        """
+        Chunk×term matrix of per-posting BM25 weights for fixed parameters, so
+        that a batch of query count vectors can be scored with one sparse product.
+        """
+        key = (k1, b, delta)
+        if key not in self._weights:
+            terms = np.repeat(np.arange(self.indptr.size - 1), np.diff(self.indptr))
+            norms = self.length_norms(k1, b)[self.doc_ids]
+            data = self.idf[terms] * (self.term_freqs * (k1 + 1.0) / (self.term_freqs + norms) + delta)
+            self._weights[key] = sparse.csc_matrix(
+                (data, self.doc_ids, self.indptr),
+                shape=(self.n_docs, self.indptr.size - 1)
+            )
+        return self._weights[key]
+
+    def score_batch(self, query_counts, k1=1.2, b=0.75, delta=0.0):
+        """BM25 scores of an m×V query count matrix against every chunk as one sparse m×N product"""
+        return sparse.csr_matrix(query_counts) @ self.weights(k1, b, delta).T
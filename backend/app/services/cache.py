@@ -0,0 +1,100 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def normalize_query(text):
+    """
+    Reduce a question to the tokens the TF-IDF analyzer would keep: lower case,
+    no punctuation or single characters, no English stop words. Two questions
+    with the same normalized form retrieve exactly the same chunks.
+    """
+    tokens = TOKEN_PATTERN.findall((text or "").lower())
+    return " ".join(token for token in tokens if token not in ENGLISH_STOP_WORDS)
+
+
+def normalize_question(text):
+    """
+    Lower-case a question and drop punctuation and extra whitespace, keeping
+    every word (unlike normalize_query, "not" or "who" still change the key).
+    """
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a time-to-live and version tagging.
+
+    Every entry remembers the version it was stored under (e.g. the search
+    index version). A lookup with a different version treats the entry as
+    stale, so rebuilding or updating the index invalidates old results without
+    having to clear the cache explicitly.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, entry_version, expires_at = entry
+            if entry_version != version:
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, version, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,169 @@
+import json
+import os
+
+import numpy as np
+
+# Per-chunk integer metadata stored as parallel arrays
+INT_FIELDS = ('chunk_id', 'page_start', 'page_end', 'char_start', 'char_end')
+
+
+class ChunkStore:
+    """
+    Compact, read-only table of chunks.
+
+    All chunk texts live in one UTF-8 byte buffer addressed by offset/size
+    arrays, and every chunk points into a small interned table of
+    (source name, path) pairs. Saved to disk as plain .npy files, it can be
+    memory-mapped, so forked workers share a single page-cache copy instead
+    of each holding millions of small Python strings and dicts.
+
+    Indexing returns the same dicts the search code has always used
+    ({'content', 'source', 'path', 'chunk_id', ...}), built on demand. Stores
+    are combined with concat() and cut with take() as whole arrays, without
+    going through per-chunk dicts.
+    """
+
+    def __init__(self, text, offsets, sizes, source_ids, sources, fields=None):
+        self.text = text
+        self.offsets = offsets
+        self.sizes = sizes
+        self.source_ids = source_ids
+        self.sources = sources
+        self.fields = fields or {}
+
+    @classmethod
+    def from_documents(cls, documents):
+        encoded = [doc['content'].encode('utf-8') for doc in documents]
+        sizes = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+        offsets = np.zeros(len(encoded), dtype=np.int64)
+        if len(encoded) > 1:
+            np.cumsum(sizes[:-1], out=offsets[1:])
+
+        source_index = {}
+        source_ids = np.fromiter(
+            (source_index.setdefault((doc['source'], doc['path']), len(source_index)) for doc in documents),
+            dtype=np.int32, count=len(documents)
+        )
+        fields = {
+            name: np.fromiter((doc.get(name, -1) for doc in documents), dtype=np.int64, count=len(documents))
+            for name in INT_FIELDS
+        }
+        return cls(
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            offsets,
+            sizes,
+            source_ids,
+            [list(source) for source in source_index],
+            fields
+        )
+
+    @classmethod
+    def concat(cls, stores):
+        """One store holding the chunks of all stores, in order"""
+        stores = [store for store in stores if len(store)]
+        if not stores:
+            return cls.from_documents([])
+
+        source_index = {}
+        texts, offsets, source_ids = [], [], []
+        shift = 0
+        for store in stores:
+            texts.append(np.asarray(store.text))
+            offsets.append(np.asarray(store.offsets) + shift)
+            shift += store.text.size
+            # Only intern the sources this store's chunks actually use
+            mapping = np.full(len(store.sources), -1, dtype=np.int32)
+            for source_id in np.unique(store.source_ids).tolist():
+                mapping[source_id] = source_index.setdefault(tuple(store.sources[source_id]), len(source_index))
+            source_ids.append(mapping[store.source_ids])
+
+        names = list(dict.fromkeys(name for store in stores for name in store.fields))
+        fields = {
+            name: np.concatenate([
+                np.asarray(store.fields[name]) if name in store.fields else np.full(len(store), -1, dtype=np.int64)
+                for store in stores
+            ])
+            for name in names
+        }
+        return cls(
+            np.concatenate(texts),
+            np.concatenate(offsets),
+            np.concatenate([np.asarray(store.sizes) for store in stores]),
+            np.concatenate(source_ids),
+            [list(source) for source in source_index],
+            fields
+        )
+
+    def take(self, start, end):
+        """Rows [start, end) as a standalone store, copied out of any memory-mapped arrays"""
+        if start >= end:
+            return ChunkStore.from_documents([])
+        text_start = int(self.offsets[start])
+        text_end = int(self.offsets[end - 1]) + int(self.sizes[end - 1])
+        return ChunkStore(
+            np.array(self.text[text_start:text_end]),
+            np.array(self.offsets[start:end]) - text_start,
+            np.array(self.sizes[start:end]),
+            np.array(self.source_ids[start:end]),
+            self.sources,
+            {name: np.array(values[start:end]) for name, values in self.fields.items()}
+        )
+
+    def __len__(self):
+        return self.offsets.size
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        source, path = self.sources[self.source_ids[i]]
+        doc = {
+            'content': self.content(i),
+            'source': source,
+            'path': path
+        }
+        for name, values in self.fields.items():
+            doc[name] = int(values[i])
+        return doc
+
+    def content(self, i):
+        start = int(self.offsets[i])
+        return self.text[start:start + int(self.sizes[i])].tobytes().decode('utf-8')
+
+    @property
+    def source_names(self):
+        return [source for source, _ in self.sources]
+
+    @property
+    def nbytes(self):
+        arrays = [self.text, self.offsets, self.sizes, self.source_ids, *self.fields.values()]
+        return sum(array.nbytes for array in arrays)
+
+    def save(self, directory):
+        np.save(os.path.join(directory, 'chunk_text.npy'), np.asarray(self.text))
+        np.save(os.path.join(directory, 'chunk_offsets.npy'), np.asarray(self.offsets))
+        np.save(os.path.join(directory, 'chunk_sizes.npy'), np.asarray(self.sizes))
+        np.save(os.path.join(directory, 'chunk_source_ids.npy'), np.asarray(self.source_ids))
+        for name, values in self.fields.items():
+            np.save(os.path.join(directory, f'chunk_{name}.npy'), np.asarray(values))
+        with open(os.path.join(directory, 'sources.json'), 'w', encoding='utf-8') as f:
+            json.dump({'sources': self.sources, 'fields': list(self.fields)}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        def load_array(name):
+            return np.load(os.path.join(directory, name), mmap_mode=mmap_mode, allow_pickle=False)
+
+        with open(os.path.join(directory, 'sources.json'), 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        return cls(
+            load_array('chunk_text.npy'),
+            load_array('chunk_offsets.npy'),
+            load_array('chunk_sizes.npy'),
+            load_array('chunk_source_ids.npy'),
+            table['sources'],
+            {name: load_array(f'chunk_{name}.npy') for name in table['fields']}
+        )
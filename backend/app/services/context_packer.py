@@ -0,0 +1,88 @@
+import os
+
+from .chunking import count_tokens, split_sentences
+
+
+def page_label(piece):
+    if piece['page_start'] == piece['page_end']:
+        return f"p. {piece['page_start']}"
+    return f"pp. {piece['page_start']}-{piece['page_end']}"
+
+
+def piece_header(piece):
+    return f"From {piece['source']} ({page_label(piece)}):"
+
+
+class ContextPacker:
+    """
+    Fit reranked chunks into a prompt token budget.
+
+    Chunks are taken in score order and added sentence by sentence until the
+    budget (headers included) is used up. Sentences already in the context,
+    such as slide headers repeated on every page, are skipped. Each chunk
+    becomes its own piece; the reranker passes at most one chunk per source.
+    """
+
+    def __init__(self, token_budget=None):
+        self.token_budget = token_budget or int(os.getenv('CONTEXT_TOKEN_BUDGET', 800))
+
+    def pack(self, documents, scores):
+        """
+        Return (pieces, stats). pieces are {'source', 'path', 'score',
+        'page_start', 'page_end', 'char_start', 'char_end', 'sentences',
+        'tokens'} in score order; stats compares the tokens of the packed
+        context with those of all chunks concatenated.
+        """
+        pieces = []
+        seen = set()
+        used = 0
+        raw = 0
+        full = False
+        for doc, score in zip(documents, scores):
+            raw += count_tokens(piece_header(doc)) + count_tokens(doc['content'])
+            if full:
+                continue
+
+            piece = {
+                'source': doc['source'],
+                'path': doc['path'],
+                'score': score,
+                'page_start': doc['page_start'],
+                'page_end': doc['page_end'],
+                'char_start': doc['char_start'],
+                'char_end': doc['char_end'],
+                'sentences': [],
+                'tokens': count_tokens(piece_header(doc))
+            }
+            in_context = False
+
+            content = doc['content']
+            for start, end in split_sentences(content):
+                sentence = content[start:end].strip()
+                key = " ".join(sentence.lower().split())
+                if not key or key in seen:
+                    continue
+                tokens = count_tokens(sentence)
+                # A new piece also pays for its header
+                cost = tokens if in_context else tokens + piece['tokens']
+                if used + cost > self.token_budget:
+                    full = True
+                    break
+                if not in_context:
+                    pieces.append(piece)
+                    used += piece['tokens']
+                    in_context = True
+                seen.add(key)
+                piece['sentences'].append(sentence)
+                piece['tokens'] += tokens
+                used += tokens
+
+        return pieces, {
+            'budget': self.token_budget,
+            'raw': raw,
+            'packed': used,
+            'saved': max(raw - used, 0)
+        }
+
+    def render(self, pieces):
+        return "\n\n".join(f"{piece_header(piece)}\n{' '.join(piece['sentences'])}" for piece in pieces)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from .cache import LRUCache
+from .chunking import TOKEN_PATTERN, count_tokens
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text after max_tokens tokens (as counted by count_tokens)"""
+    if max_tokens <= 0:
+        return ""
+    for index, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if index == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def new_session():
+    return {'summary': "", 'turns': [], 'summarized': 0, 'updated': time.time()}
+
+
+class MemorySessionStore:
+    """Sessions kept in this process only; lost on restart and not shared between workers"""
+
+    def __init__(self, max_sessions=1000, ttl=86400):
+        self.sessions = LRUCache(max_entries=max_sessions, ttl=ttl)
+
+    def load(self, session_id):
+        session = self.sessions.get(session_id)
+        # Hand out copies so callers can't change a stored session without save()
+        return dict(session, turns=list(session['turns'])) if session else None
+
+    def save(self, session_id, session):
+        self.sessions.put(session_id, session)
+
+    def stats(self):
+        return {'backend': 'memory', 'sessions': self.sessions.stats()['size']}
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in a SQLite file, shared by all workers and kept across restarts.
+    Each process opens its own connection on first use, so a store created
+    before gunicorn forks never shares a connection between workers.
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+
+    def _connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    def load(self, session_id):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT data, updated FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None or (self.ttl and row[1] < time.time() - self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def save(self, session_id, session):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(session), session['updated'])
+                )
+                if self.ttl:
+                    connection.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+
+    def stats(self):
+        with self.lock:
+            count, = self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return {'backend': 'sqlite', 'path': self.path, 'sessions': count}
+
+
+def session_store():
+    """SQLite store when CONVERSATION_DB names a file, in-memory otherwise"""
+    ttl = float(os.getenv('CONVERSATION_TTL', 86400))
+    path = os.getenv('CONVERSATION_DB')
+    if path:
+        return SQLiteSessionStore(path, ttl=ttl)
+    return MemorySessionStore(max_sessions=int(os.getenv('CONVERSATION_MAX_SESSIONS', 1000)), ttl=ttl)
+
+
+class ConversationMemory:
+    """
+    Bounded per-session chat history.
+
+    The last recent_turns (question, answer) pairs are kept verbatim. Older
+    turns are folded into a rolling summary by summarize(summary, turns) on a
+    background job queue, so answering never waits for it; until a fold
+    finishes the summary simply lags behind by a turn or two. When summarize
+    fails, the older questions are appended to the summary instead.
+
+    history() never returns more than token_budget tokens: the summary is
+    capped at summary_tokens and the verbatim turns fill the rest, newest
+    first. Together with the context budget that keeps every prompt under a
+    fixed size however long the conversation runs.
+    """
+
+    def __init__(self, store=None, summarize=None, jobs=None, recent_turns=None, token_budget=None,
+                 summary_tokens=None):
+        self.store = store or session_store()
+        self.summarize = summarize
+        self.jobs = jobs
+        self.recent_turns = recent_turns or int(os.getenv('CONVERSATION_RECENT_TURNS', 4))
+        self.token_budget = token_budget or int(os.getenv('CONVERSATION_TOKEN_BUDGET', 600))
+        self.summary_tokens = summary_tokens or int(os.getenv('CONVERSATION_SUMMARY_TOKENS', 200))
+        self.lock = threading.Lock()
+        self.summarizing = set()
+        self.summaries = 0
+        self.summary_failures = 0
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    def history(self, session_id):
+        """{'summary', 'turns', 'tokens'} of a session, within token_budget"""
+        session = self.store.load(session_id) if session_id else None
+        if not session:
+            return {'summary': "", 'turns': [], 'tokens': 0}
+
+        summary = truncate_tokens(session['summary'], min(self.summary_tokens, self.token_budget))
+        remaining = self.token_budget - count_tokens(summary)
+        turns = []
+        for question, answer in reversed(session['turns'][-self.recent_turns:]):
+            question_tokens = count_tokens(question)
+            answer_tokens = count_tokens(answer)
+            if question_tokens + answer_tokens > remaining:
+                if turns or question_tokens >= remaining:
+                    break
+                # The latest turn alone is over budget: keep the question and the start of the answer
+                answer = truncate_tokens(answer, remaining - question_tokens)
+                answer_tokens = count_tokens(answer)
+            turns.append((question, answer))
+            remaining -= question_tokens + answer_tokens
+        turns.reverse()
+        return {'summary': summary, 'turns': turns, 'tokens': self.token_budget - remaining}
+
+    @staticmethod
+    def fingerprint(history):
+        """Stable key of a history, for caches whose answers depend on it"""
+        if not history['summary'] and not history['turns']:
+            return None
+        payload = json.dumps([history['summary'], history['turns']])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def append(self, session_id, question, answer):
+        with self.lock:
+            session = self.store.load(session_id) or new_session()
+            session['turns'].append([question, answer])
+            session['updated'] = time.time()
+            self.store.save(session_id, session)
+            overflow = len(session['turns']) > self.recent_turns
+            if overflow and session_id not in self.summarizing:
+                self.summarizing.add(session_id)
+            else:
+                overflow = False
+        if overflow:
+            if self.jobs:
+                self.jobs.submit(self._fold, session_id)
+            else:
+                self._fold(session_id)
+
+    def _fold(self, session_id):
+        """Fold every turn older than the recent ones into the summary"""
+        try:
+            session = self.store.load(session_id)
+            if not session:
+                return
+            older = session['turns'][:-self.recent_turns]
+            if not older:
+                return
+            summary = self._summarize(session['summary'], older)
+
+            with self.lock:
+                current = self.store.load(session_id)
+                # Another worker folded the same turns meanwhile (shared SQLite store)
+                if not current or current['summarized'] != session['summarized']:
+                    return
+                current['summary'] = summary
+                current['turns'] = current['turns'][len(older):]
+                current['summarized'] += len(older)
+                self.store.save(session_id, current)
+        finally:
+            with self.lock:
+                self.summarizing.discard(session_id)
+
+    def _summarize(self, summary, turns):
+        if self.summarize:
+            try:
+                result = self.summarize(summary, turns)
+                if result:
+                    self.summaries += 1
+                    return truncate_tokens(result.strip(), self.summary_tokens)
+            except Exception as e:
+                print(f"Error summarizing conversation: {str(e)}")
+            self.summary_failures += 1
+        questions = " ".join(f"Asked: {question}" for question, _ in turns)
+        # Keep the latest questions when the fallback summary runs over its cap
+        combined = f"{summary} {questions}".strip()
+        tokens = list(TOKEN_PATTERN.finditer(combined))
+        if len(tokens) <= self.summary_tokens:
+            return combined
+        return combined[tokens[-self.summary_tokens].start():]
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                self.store.stats(),
+                summarizing=len(self.summarizing),
+                summaries=self.summaries,
+                summary_failures=self.summary_failures
+            )
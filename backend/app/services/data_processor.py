@@ -7,12 +7,17 @@ from dotenv import load_dotenv
 from pypdf import PdfReader
 import gc  # For garbage collection
 
+try:
+    from .chunking import Chunker
+except ImportError:  # Run as a script from app/services
+    from chunking import Chunker
+
 load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def extract_text_from_pdf(file_path, max_pages=None):
-    """Extract text from PDF files with memory management"""
+def extract_pages_from_pdf(file_path, max_pages=None):
+    """Extract the text of every page of a PDF with memory management"""
     try:
         print(f"Starting to read PDF: {file_path}")
         print(f"File exists: {os.path.exists(file_path)}")
@@ -21,21 +26,23 @@ def extract_text_from_pdf(file_path, max_pages=None):
         reader = PdfReader(file_path)
         print(f"PDF loaded, pages: {len(reader.pages)}")
         
-        text = ""
+        pages = []
         pages_to_process = min(len(reader.pages), max_pages) if max_pages else len(reader.pages)
         
         for i in range(pages_to_process):
             print(f"Processing page {i+1}/{pages_to_process}")
             try:
                 page = reader.pages[i]
-                text += page.extract_text() + "\n"
+                pages.append(page.extract_text() or "")
                 if (i + 1) % 5 == 0:  # Garbage collect more frequently
                     gc.collect()
             except Exception as page_error:
                 print(f"Error on page {i+1}: {page_error}")
+                # Keep the slot so later page numbers stay correct
+                pages.append("")
                 continue
                 
-        return text
+        return pages
     except Exception as e:
         print(f"Error processing PDF {file_path}: {e}")
         print(f"Error type: {type(e)}")
@@ -66,23 +73,27 @@ def process_directory(directory_path):
         try:
             # Extract text
             print("Extracting text...")
-            text = extract_text_from_pdf(file_path)
-            print(f"Extracted text length: {len(text) if text else 0} characters")
+            pages = extract_pages_from_pdf(file_path)
+            print(f"Extracted text length: {sum(len(page) for page in pages) if pages else 0} characters")
             
-            if text:
+            if pages and any(pages):
                 # Create chunks
                 print("Creating chunks...")
-                chunks = chunk_text(text)
+                chunks = chunk_pages(pages)
                 print(f"Created {len(chunks)} chunks")
                 
                 # Add chunks and metadata
                 for chunk in chunks:
-                    all_chunks.append(chunk)
+                    all_chunks.append(chunk['content'])
                     metadata.append({
                         "source": file_path,
                         "filename": file_name,
                         "type": "pdf",
-                        "chunk_size": len(chunk)
+                        "chunk_size": len(chunk['content']),
+                        "page_start": chunk['page_start'],
+                        "page_end": chunk['page_end'],
+                        "char_start": chunk['char_start'],
+                        "char_end": chunk['char_end']
                     })
                 
                 print(f"Successfully processed {file_name}")
@@ -101,51 +112,15 @@ def process_directory(directory_path):
     print(f"\nTotal processing complete. Generated {len(all_chunks)} chunks")
     return all_chunks, metadata
 
-def chunk_text(text, chunk_size=2000, overlap=200, max_chunks=1000):
-    """Split text into smaller chunks with less overlap and a maximum limit"""
-    print(f"Starting to chunk text of length {len(text)}")
-    if not text:
-        return []
-        
-    chunks = []
-    start = 0
-    text_length = len(text)
-    chunk_count = 0
-
-    while start < text_length and chunk_count < max_chunks:
-        end = start + chunk_size
-        if end > text_length:
-            end = text_length
-        
-        # Try to find a natural break point (period, newline, or space)
-        if end < text_length:
-            for break_char in ['. ', '\n', ' ']:
-                natural_break = text.rfind(break_char, start, end)
-                if natural_break != -1:
-                    end = natural_break + 1
-                    break
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-            chunk_count += 1
-            if chunk_count % 10 == 0:  # Reduced progress reporting frequency
-                print(f"Created {chunk_count} chunks so far...")
-        
-        if chunk_count >= max_chunks:
-            print(f"Reached maximum chunk limit of {max_chunks}")
-            break
-            
-        start = end
-        if start < text_length:
-            # Find the start of the next sentence for better overlap
-            next_sentence = text.find('. ', start - overlap, start)
-            if next_sentence != -1:
-                start = next_sentence + 2
-        
-        if len(chunks) % 50 == 0:
-            gc.collect()
-    
+def chunk_pages(pages, max_tokens=None, max_chunks=1000):
+    """
+    Split the pages of one document with the shared sentence/token-budget
+    chunker. Returns chunk dicts carrying page numbers and character offsets.
+    """
+    chunks = Chunker(max_tokens=max_tokens).chunk_pages(pages)
+    if len(chunks) > max_chunks:
+        print(f"Reached maximum chunk limit of {max_chunks}")
+        chunks = chunks[:max_chunks]
     print(f"Finished creating {len(chunks)} chunks")
     return chunks
 
@@ -1,8 +1,7 @@
 import os
 import requests
 from dotenv import load_dotenv
-import base64
-import json
+from .resilience import circuit_breaker
 
 load_dotenv()
 
@@ -12,8 +11,19 @@ class ImageService:
         if not self.api_key:
             print("Warning: STABILITY_API_KEY not found in environment variables")
         self.api_host = 'https://api.stability.ai'
+        # SDXL at 30 steps takes tens of seconds, so the cap is generous but finite
+        self.timeout = float(os.getenv('IMAGE_TIMEOUT', 60))
+        self.connect_timeout = float(os.getenv('IMAGE_CONNECT_TIMEOUT', 5))
+        self.breaker = circuit_breaker('stability')
 
-    def generate_image(self, prompt):
+    def generate_image(self, prompt, deadline=None):
+        """
+        Return the image as PNG bytes, or None if generation failed. Raises
+        UpstreamUnavailable without calling the API when its circuit is open
+        or the request deadline has run out.
+        """
+        timeout = deadline.timeout(self.timeout) if deadline else self.timeout
+        self.breaker.check()
         try:
             print(f"Attempting to generate image with prompt: {prompt}")
             print(f"Using API key: {self.api_key[:6]}...")  # Print first 6 chars for verification
@@ -22,7 +32,8 @@ class ImageService:
                 f"{self.api_host}/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
                 headers={
                     "Content-Type": "application/json",
-                    "Accept": "application/json",
+                    # Raw PNG body instead of base64 inside JSON
+                    "Accept": "image/png",
                     "Authorization": f"Bearer {self.api_key}"
                 },
                 json={
@@ -36,26 +47,36 @@ class ImageService:
                     "steps": 30,
                     "width": 1024,
                     "height": 1024,
-                }
+                },
+                timeout=(min(self.connect_timeout, timeout), timeout)
             )
 
             print(f"Response status code: {response.status_code}")
             
             if response.status_code != 200:
                 print(f"Error response: {response.text}")
+                # Client errors (bad prompt, auth) say nothing about the upstream's health
+                if response.status_code >= 500 or response.status_code == 429:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
                 raise Exception(f"API returned status code {response.status_code}: {response.text}")
 
-            data = response.json()
+            self.breaker.record_success()
             print("Successfully received response from Stability API")
             
-            if "artifacts" in data and len(data["artifacts"]) > 0:
+            if response.content:
                 print("Image generated successfully")
-                return data["artifacts"][0]["base64"]
+                return response.content
             else:
-                print("No artifacts found in response")
-                print(f"Response data: {json.dumps(data, indent=2)}")
+                print("Empty image in response")
                 return None
 
+        except requests.RequestException as e:
+            # Timeouts and connection errors
+            self.breaker.record_failure()
+            print(f"Detailed error in generate_image: {str(e)}")
+            return None
         except Exception as e:
             print(f"Detailed error in generate_image: {str(e)}")
             import traceback
@@ -0,0 +1,197 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from .chunk_store import ChunkStore
+
+
+class IncrementalIndex:
+    """
+    Term-count index kept as one segment per source file.
+
+    Adding or removing a source only tokenizes that source and adjusts the
+    running document-frequency counts; the vocabulary grows as new terms show
+    up. The combined count matrix, the IDF weights and the normalized TF-IDF
+    matrix are rebuilt lazily by materialize() the next time they are needed,
+    and give the same weights as TfidfVectorizer(stop_words='english') fitted
+    on all chunks.
+
+    Each segment keeps its chunks as a ChunkStore, so rebuilding only
+    concatenates arrays; per-chunk work is limited to the source that changed.
+    An index restored from disk keeps pointing into the stored (memory-mapped)
+    arrays; a segment is only copied out of them when it has to be, i.e. when
+    the index is rebuilt after a change.
+    """
+
+    def __init__(self, stop_words='english'):
+        self.analyzer = CountVectorizer(stop_words=stop_words).build_analyzer()
+        self.vocabulary = {}
+        self.doc_freq = np.zeros(0, dtype=np.int64)
+        self.segments = {}
+        self.version = 0
+        self._base = None
+        self._state = None
+
+    def __contains__(self, path):
+        return path in self.segments
+
+    @property
+    def sources(self):
+        return sorted(self.segments)
+
+    def _count(self, texts):
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            counts = {}
+            for token in self.analyzer(text):
+                term = self.vocabulary.get(token)
+                if term is None:
+                    term = self.vocabulary[token] = len(self.vocabulary)
+                counts[term] = counts.get(term, 0) + 1
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+
+        if self.doc_freq.size < len(self.vocabulary):
+            grown = np.zeros(len(self.vocabulary), dtype=np.int64)
+            grown[:self.doc_freq.size] = self.doc_freq
+            self.doc_freq = grown
+
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(texts), len(self.vocabulary))
+        )
+        matrix.sort_indices()
+        return matrix
+
+    def _segment_counts(self, segment):
+        if segment['term_counts'] is None:
+            start, end = segment['rows']
+            segment['term_counts'] = self._base['term_counts'][start:end]
+        return segment['term_counts']
+
+    def _segment_documents(self, segment):
+        if segment['documents'] is None:
+            start, end = segment['rows']
+            segment['documents'] = self._base['documents'].take(start, end)
+        return segment['documents']
+
+    def add_source(self, path, documents):
+        """
+        Index the chunks of one source file, replacing any previous version of
+        it. An empty chunk list still records the source as indexed.
+        """
+        if path in self.segments:
+            self.remove_source(path)
+        term_counts = self._count([doc['content'] for doc in documents])
+        np.add.at(self.doc_freq, term_counts.indices, 1)
+        self.segments[path] = {'documents': ChunkStore.from_documents(documents), 'term_counts': term_counts}
+        self.version += 1
+
+    def remove_source(self, path):
+        segment = self.segments.pop(path, None)
+        if segment is None:
+            return False
+        np.subtract.at(self.doc_freq, self._segment_counts(segment).indices, 1)
+        self.version += 1
+        return True
+
+    def restore(self, index, sources=()):
+        """
+        Adopt an index loaded by IndexStore. Chunks of one source must be
+        contiguous, which is how materialize() lays them out. Paths in sources
+        without any chunk (e.g. scanned PDFs with no text) get empty segments so
+        they are still known to be indexed.
+        """
+        documents = index['documents']
+        self.vocabulary = dict(index['vocabulary'])
+        self.doc_freq = np.diff(index['count_postings'].indptr).astype(np.int64)
+        self.segments = {}
+
+        # Rows where the source changes delimit the segments
+        source_ids = np.asarray(documents.source_ids)
+        boundaries = np.concatenate([[0], np.flatnonzero(np.diff(source_ids)) + 1, [source_ids.size]])
+        for start, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+            if start < end:
+                path = documents.sources[source_ids[start]][1]
+                self.segments[path] = {'documents': None, 'term_counts': None, 'rows': (start, end)}
+        for path in sources:
+            if path not in self.segments:
+                self.segments[path] = {
+                    'documents': ChunkStore.from_documents([]),
+                    'term_counts': sparse.csr_matrix((0, len(self.vocabulary)), dtype=np.int32)
+                }
+        self.version += 1
+
+        self._base = {'documents': documents, 'term_counts': index['term_counts']}
+        self._state = {
+            'version': self.version,
+            'vocabulary': dict(self.vocabulary),
+            'documents': documents,
+            'term_counts': index['term_counts'],
+            'count_postings': index['count_postings'],
+            'chunk_lengths': index['chunk_lengths'],
+            'idf': index['idf'],
+            'vectors': index['vectors'],
+            'postings': index['postings']
+        }
+
+    def materialize(self):
+        """Return the combined index, recomputing IDF and TF-IDF only after a change"""
+        if self._state is not None and self._state['version'] == self.version:
+            return self._state
+
+        n_terms = len(self.vocabulary)
+        stores = []
+        blocks = []
+        for path in self.sources:
+            segment = self.segments[path]
+            term_counts = self._segment_counts(segment)
+            if term_counts.shape[1] < n_terms:
+                # Segments indexed before the vocabulary grew just gain empty columns
+                term_counts = sparse.csr_matrix(
+                    (term_counts.data, term_counts.indices, term_counts.indptr),
+                    shape=(term_counts.shape[0], n_terms)
+                )
+                segment['term_counts'] = term_counts
+            stores.append(self._segment_documents(segment))
+            blocks.append(term_counts)
+        # Every segment now holds its own rows, so the stored arrays can be released
+        self._base = None
+
+        if blocks:
+            term_counts = sparse.vstack(blocks, format='csr', dtype=np.int32)
+        else:
+            term_counts = sparse.csr_matrix((0, n_terms), dtype=np.int32)
+
+        # Smoothed IDF as in TfidfTransformer; terms no chunk uses any more get no weight
+        n_docs = term_counts.shape[0]
+        idf = np.log((1 + n_docs) / (1 + self.doc_freq)) + 1
+        idf[self.doc_freq == 0] = 0.0
+        if n_docs:
+            vectors = normalize(term_counts @ sparse.diags(idf), norm='l2', copy=False)
+            vectors = sparse.csr_matrix(vectors, dtype=np.float32)
+        else:
+            # No chunks at all (empty or unreadable corpus); normalize() rejects 0-row matrices
+            vectors = sparse.csr_matrix((0, n_terms), dtype=np.float32)
+
+        postings = vectors.tocsc()
+        postings.sort_indices()
+        count_postings = term_counts.tocsc()
+        count_postings.sort_indices()
+
+        self._state = {
+            'version': self.version,
+            'vocabulary': dict(self.vocabulary),
+            'documents': ChunkStore.concat(stores),
+            'term_counts': term_counts,
+            'count_postings': count_postings,
+            'chunk_lengths': term_counts.sum(axis=1).A1,
+            'idf': idf,
+            'vectors': vectors,
+            'postings': postings
+        }
+        return self._state
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+
+from .chunk_store import ChunkStore
+
+# Bump whenever the on-disk layout changes so stale artifacts get rebuilt
+INDEX_FORMAT_VERSION = 4
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """Hash a file in blocks so large PDFs don't have to fit in memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_sources(root, extension='.pdf'):
+    """List source files under root in a stable order with their size and mtime"""
+    sources = []
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        for file in sorted(files):
+            if file.endswith(extension):
+                file_path = os.path.join(dirpath, file)
+                stat = os.stat(file_path)
+                sources.append({
+                    'path': file_path,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime
+                })
+    return sources
+
+
+class IndexStore:
+    """
+    Versioned on-disk copy of the SearchService index.
+
+    The artifact is a directory holding the fitted vocabulary and IDF weights,
+    the float32 TF-IDF and int32 term-count matrices as .npy arrays (in both
+    CSR and CSC layout, so the posting lists don't have to be rebuilt),
+    per-chunk token counts, the ChunkStore and a manifest of the source files
+    it was built from. It is replaced atomically on save.
+
+    settings (e.g. the chunker configuration) are recorded in the manifest; an
+    artifact built with different settings is treated as missing.
+
+    Arrays are loaded memory-mapped by default, so every worker process that
+    opens the same artifact shares the page cache instead of its own copy.
+    """
+
+    def __init__(self, path="./data/search_index", mmap_mode='r', settings=None):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.settings = settings or {}
+
+    def _file(self, name, root=None):
+        return os.path.join(root or self.path, name)
+
+    def _load_array(self, name):
+        return np.load(self._file(name), mmap_mode=self.mmap_mode, allow_pickle=False)
+
+    def _save_sparse(self, name, matrix, root):
+        np.save(self._file(f'{name}_data.npy', root), matrix.data)
+        np.save(self._file(f'{name}_indices.npy', root), matrix.indices)
+        np.save(self._file(f'{name}_indptr.npy', root), matrix.indptr)
+
+    def _load_sparse(self, name, shape, matrix_type=sparse.csr_matrix):
+        return matrix_type(
+            (
+                self._load_array(f'{name}_data.npy'),
+                self._load_array(f'{name}_indices.npy'),
+                self._load_array(f'{name}_indptr.npy')
+            ),
+            shape=shape,
+            copy=False
+        )
+
+    def _known_hash(self, source, known):
+        entry = known.get(source['path'])
+        if entry and entry['size'] == source['size'] and entry['mtime'] == source['mtime']:
+            return entry.get('sha256')
+        return None
+
+    def _is_compatible(self, manifest):
+        return (
+            bool(manifest)
+            and manifest.get('format_version') == INDEX_FORMAT_VERSION
+            and manifest.get('settings', {}) == self.settings
+        )
+
+    def read_manifest(self):
+        try:
+            with open(self._file('manifest.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def diff_sources(self, sources, manifest=None):
+        """
+        Compare a fresh source scan with the stored manifest.
+
+        Returns (changed, removed): paths that are new or whose content changed,
+        and paths that no longer exist. Size and mtime are compared first; a
+        file is only re-hashed when they differ, so touching a PDF without
+        changing it does not count as a change. Hashes computed here are kept
+        in the source entries, for save() and touch().
+        """
+        manifest = manifest or self.read_manifest() or {}
+        stored = {entry['path']: entry for entry in manifest.get('sources', [])}
+        current = {source['path'] for source in sources}
+
+        changed = []
+        for source in sources:
+            entry = stored.get(source['path'])
+            if entry is None or entry['size'] != source['size']:
+                changed.append(source['path'])
+            elif entry['mtime'] != source['mtime']:
+                source['sha256'] = file_sha256(source['path'])
+                if source['sha256'] != entry['sha256']:
+                    changed.append(source['path'])
+        removed = [path for path in stored if path not in current]
+        return changed, removed
+
+    def touch(self, sources, manifest=None):
+        """
+        Record the new mtime of files whose content diff_sources() found
+        unchanged, so they are not hashed again on every start. Only the
+        manifest is rewritten.
+        """
+        manifest = manifest or self.read_manifest()
+        if not manifest:
+            return False
+        hashed = {source['path']: source for source in sources if 'sha256' in source}
+        updated = False
+        for entry in manifest.get('sources', []):
+            source = hashed.get(entry['path'])
+            if source and source['sha256'] == entry['sha256'] and source['mtime'] != entry['mtime']:
+                entry['mtime'] = source['mtime']
+                updated = True
+        if updated:
+            descriptor, temporary = tempfile.mkstemp(prefix='.manifest-', dir=self.path)
+            try:
+                with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, indent=2)
+                os.replace(temporary, self._file('manifest.json'))
+            except Exception:
+                os.unlink(temporary)
+                raise
+        return updated
+
+    def is_current(self, sources, manifest=None):
+        manifest = manifest or self.read_manifest()
+        if not self._is_compatible(manifest):
+            return False
+        changed, removed = self.diff_sources(sources, manifest)
+        return not changed and not removed
+
+    def load(self):
+        """
+        Return the stored index together with its manifest, or None when there
+        is no readable artifact of the current format and settings. Use
+        diff_sources() to find out which sources changed since it was written.
+        """
+        manifest = self.read_manifest()
+        if not self._is_compatible(manifest):
+            return None
+
+        try:
+            with open(self._file('vocabulary.json'), 'r', encoding='utf-8') as f:
+                terms = json.load(f)
+
+            shape = tuple(manifest['shape'])
+            return {
+                'manifest': manifest,
+                'vocabulary': {term: i for i, term in enumerate(terms)},
+                'idf': self._load_array('idf.npy'),
+                'vectors': self._load_sparse('vectors', shape),
+                'postings': self._load_sparse('postings', shape, sparse.csc_matrix),
+                'term_counts': self._load_sparse('term_counts', shape),
+                'count_postings': self._load_sparse('count_postings', shape, sparse.csc_matrix),
+                'chunk_lengths': self._load_array('chunk_lengths.npy'),
+                'documents': ChunkStore.load(self.path, self.mmap_mode)
+            }
+        except Exception as e:
+            print(f"Error loading search index from {self.path}: {e}")
+            return None
+
+    def save(self, sources, state):
+        """
+        Write the index to a temporary directory and swap it into place. Hashes
+        from the previous manifest are reused for files whose size and mtime
+        did not change.
+        """
+        previous_manifest = self.read_manifest() or {}
+        known = {entry['path']: entry for entry in previous_manifest.get('sources', [])}
+
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.search_index-', dir=parent)
+
+        try:
+            terms = [None] * len(state['vocabulary'])
+            for term, i in state['vocabulary'].items():
+                terms[i] = term
+            with open(self._file('vocabulary.json', staging), 'w', encoding='utf-8') as f:
+                json.dump(terms, f)
+
+            np.save(self._file('idf.npy', staging), np.asarray(state['idf']))
+            self._save_sparse('vectors', state['vectors'], staging)
+            self._save_sparse('postings', state['postings'], staging)
+            self._save_sparse('term_counts', state['term_counts'], staging)
+            self._save_sparse('count_postings', state['count_postings'], staging)
+            np.save(self._file('chunk_lengths.npy', staging), np.asarray(state['chunk_lengths']))
+            state['documents'].save(staging)
+
+            manifest = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'created': time.time(),
+                'settings': self.settings,
+                'shape': list(state['vectors'].shape),
+                'sources': [
+                    dict(source, sha256=source.get('sha256') or self._known_hash(source, known)
+                         or file_sha256(source['path']))
+                    for source in sources
+                ]
+            }
+            # The manifest goes last so a half-written directory never looks valid
+            with open(self._file('manifest.json', staging), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+
+            previous = None
+            if os.path.exists(self.path):
+                previous = self.path + '.old'
+                shutil.rmtree(previous, ignore_errors=True)
+                os.replace(self.path, previous)
+            os.replace(staging, self.path)
+            if previous:
+                shutil.rmtree(previous, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
@@ -0,0 +1,102 @@
+import os
+import re
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .cache import normalize_question
+
+SMALL_TALK = 'small_talk'
+GENERAL = 'general'
+RAG = 'rag'
+
+# Phrases that make up a whole small-talk message, by intent
+SMALL_TALK_PATTERNS = {
+    'greeting': r"(?:hi|hello|hey|hiya|howdy|good (?:morning|afternoon|evening))(?: there| everyone| all)?",
+    'how_are_you': r"how are you(?: doing)?|how s it going|what s up|whats up",
+    'identity': r"who are you|what are you|what can you do",
+    'thanks': r"thanks|thank you|thx|ty|ok|okay|cool|great|got it"
+              r"|(?:thanks|thank you) (?:so |very )?much|(?:thanks|thank you) for (?:the|your) help",
+    'goodbye': r"bye|goodbye|see you(?: later)?|see ya"
+}
+
+SMALL_TALK_REPLIES = {
+    'greeting': "Hi! I'm the PTRS:6224 course assistant. Ask me anything about the course material.",
+    'how_are_you': "I'm doing well, thanks for asking! What would you like to know about the course?",
+    'identity': "I'm the teaching assistant for PTRS:6224. I can answer questions about the lectures "
+                "and course materials, explain concepts and generate anatomical illustrations.",
+    'thanks': "You're welcome! Let me know if you have any other questions about the course.",
+    'goodbye': "Goodbye! Good luck with your studies."
+}
+
+GENERAL_KEYWORDS = [
+    'weather', 'time', 'hello', 'hi', 'hey',
+    'how are you', 'what\'s up', 'good morning',
+    'good afternoon', 'good evening', 'thanks',
+    'thank you', 'bye', 'goodbye', 'who are you'
+]
+
+COURSE_KEYWORDS = [
+    'ptrs', 'muscle', 'neural', 'plasticity', 'motor unit',
+    'metabolism', 'epigenetics', 'rehabilitation', 'spinal cord',
+    'biomechanics', 'motor control', 'hill equation', 'exercise',
+    'physical therapy', 'movement', 'strength training',
+    'fitness', 'anatomy', 'physiology', 'health', 'medical',
+    'patient', 'treatment', 'therapy', 'clinical', 'research',
+    'lecture', 'course', 'exam', 'assignment', 'study'
+]
+
+
+def keyword_pattern(keywords):
+    """One compiled alternation with word boundaries, longest keywords first"""
+    alternation = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternation})\b")
+
+
+class IntentRouter:
+    """
+    Cheap routing step that runs before retrieval.
+
+    Messages made up only of small-talk phrases get a canned reply without
+    search or LLM call. Everything else is scored against the search index:
+    the IDF weights of its terms that occur in the course material are summed,
+    and a message reaching min_score, or containing a course keyword, goes
+    through retrieval and the LLM (RAG). The rest is answered by the LLM
+    without retrieval, since no chunk could match it anyway.
+    """
+
+    def __init__(self, search_service=None, min_score=None):
+        self.search_service = search_service
+        self.min_score = float(os.getenv('ROUTER_MIN_SCORE', 1.0)) if min_score is None else min_score
+        self.analyzer = TfidfVectorizer(stop_words='english').build_analyzer()
+        phrase = "|".join(f"(?:{pattern})" for pattern in SMALL_TALK_PATTERNS.values())
+        last_phrase = "|".join(f"(?P<{intent}>{pattern})" for intent, pattern in SMALL_TALK_PATTERNS.items())
+        self.small_talk = re.compile(rf"(?:(?:{phrase}) )*(?:{last_phrase})")
+        self.course_keywords = keyword_pattern(COURSE_KEYWORDS)
+        self.general_keywords = keyword_pattern(GENERAL_KEYWORDS)
+
+    def index_score(self, message):
+        """Sum of the IDF weights of the distinct message terms found in the index"""
+        vectorizer = getattr(self.search_service, 'vectorizer', None)
+        vocabulary = getattr(vectorizer, 'vocabulary_', None)
+        if not vocabulary:
+            return 0.0
+        idf = vectorizer.idf_
+        terms = {vocabulary[token] for token in self.analyzer(message) if token in vocabulary}
+        return float(sum(idf[term] for term in terms))
+
+    def route(self, message):
+        """
+        Return {'route', 'intent', 'score', 'reply'}; reply is only set for
+        small talk.
+        """
+        normalized = normalize_question(message)
+        match = self.small_talk.fullmatch(normalized)
+        if match:
+            # The last phrase decides the reply ("hi, how are you" -> how_are_you)
+            return {'route': SMALL_TALK, 'intent': match.lastgroup, 'score': 0.0,
+                    'reply': SMALL_TALK_REPLIES[match.lastgroup]}
+
+        score = self.index_score(message)
+        if score >= self.min_score or self.course_keywords.search(message.lower()):
+            return {'route': RAG, 'intent': None, 'score': score, 'reply': None}
+        return {'route': GENERAL, 'intent': None, 'score': score, 'reply': None}
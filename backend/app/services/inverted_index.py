@@ -0,0 +1,121 @@
+import numpy as np
+from scipy import sparse
+
+
+def top_k_per_row(scores, k):
+    """
+    Row-wise top-k of a sparse score matrix. Returns two lists with one array
+    per row: chunk indices and their scores, best first (lower index on ties).
+    """
+    scores = sparse.csr_matrix(scores)
+    row_lengths = np.diff(scores.indptr)
+    rows = np.repeat(np.arange(scores.shape[0]), row_lengths)
+    order = np.lexsort((scores.indices, -scores.data, rows))
+    # order is grouped by row, so the position inside a row is the offset from its start
+    keep = np.arange(order.size) - scores.indptr[rows] < k
+    selected = order[keep]
+    splits = np.cumsum(np.minimum(row_lengths, k))[:-1]
+    return (
+        np.split(scores.indices[selected].astype(np.int64), splits),
+        np.split(scores.data[selected].astype(np.float64), splits)
+    )
+
+
+class InvertedIndex:
+    """
+    Posting lists over the TF-IDF matrix with MaxScore top-k retrieval.
+
+    Rows of the matrix are L2-normalized, so the dot product of a (normalized)
+    query vector with a row is exactly its cosine similarity. Query terms are
+    processed in decreasing order of their score upper bound (query weight times
+    the largest weight in the posting list). Once the k-th best accumulated
+    score is larger than what the remaining terms could add, no new document can
+    enter the top-k: the remaining terms are only looked up for the surviving
+    candidates, and candidates that can no longer catch up are dropped.
+    """
+
+    def __init__(self, vectors):
+        postings = sparse.csc_matrix(vectors)
+        postings.sort_indices()
+        self.postings = postings
+        self.n_docs = postings.shape[0]
+        self.indptr = postings.indptr
+        self.doc_ids = postings.indices
+        self.weights = postings.data
+
+        # Upper bound of every term's contribution to a document score
+        self.max_weights = np.zeros(postings.shape[1], dtype=self.weights.dtype)
+        nonempty = np.diff(self.indptr) > 0
+        if self.weights.size:
+            self.max_weights[nonempty] = np.maximum.reduceat(self.weights, self.indptr[:-1][nonempty])
+
+    def term_postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def top_k(self, query_vector, k):
+        """
+        Return (doc_indices, scores) of the k best documents for a 1×V query
+        vector, best first. Only documents sharing a term with the query are
+        returned.
+        """
+        empty = np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        query_vector = sparse.csr_matrix(query_vector)
+        terms = query_vector.indices
+        query_weights = query_vector.data
+        if k <= 0 or not terms.size:
+            return empty
+
+        bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        order = order[bounds[order] > 0]
+        if not order.size:
+            return empty
+        terms, query_weights, bounds = terms[order], query_weights[order], bounds[order]
+        # remaining[i] is the most that terms i.. can still add to any document
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        scores = np.zeros(self.n_docs)
+        seen = []
+        candidates = None
+        threshold = 0.0
+
+        for i, term in enumerate(terms):
+            docs, weights = self.term_postings(term)
+
+            if candidates is None:
+                # Essential term: any of its documents may still enter the top-k
+                scores[docs] += query_weights[i] * weights
+                seen.append(docs)
+                if remaining[i + 1] == 0.0:
+                    continue
+                merged = np.unique(np.concatenate(seen))
+                if merged.size >= k:
+                    threshold = np.partition(scores[merged], merged.size - k)[merged.size - k]
+                    if remaining[i + 1] < threshold:
+                        candidates = merged
+                continue
+
+            # Non-essential term: only refine documents that can still reach the threshold
+            candidates = candidates[scores[candidates] + remaining[i] >= threshold]
+            positions = np.searchsorted(docs, candidates)
+            found = positions < docs.size
+            found[found] = docs[positions[found]] == candidates[found]
+            scores[candidates[found]] += query_weights[i] * weights[positions[found]]
+            threshold = np.partition(scores[candidates], candidates.size - k)[candidates.size - k]
+
+        if candidates is None:
+            candidates = np.unique(np.concatenate(seen))
+
+        candidate_scores = scores[candidates]
+        if candidates.size > k:
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+        else:
+            top = np.arange(candidates.size)
+        # Best score first, lower chunk index first on ties
+        top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+        return candidates[top], candidate_scores[top]
+
+    def score_batch(self, query_vectors):
+        """Cosine scores of an m×V query matrix against every chunk as one sparse m×N product"""
+        return sparse.csr_matrix(query_vectors) @ self.postings.T
@@ -0,0 +1,160 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import metrics
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobLimitExceeded(Exception):
+    """An owner already has max_per_owner jobs pending or running"""
+
+
+class JobQueue:
+    """
+    Background worker pool for slow side tasks (speech synthesis, ...) whose
+    results are fetched later by id.
+
+    submit() returns a job id right away; the function runs on one of
+    max_workers threads. Finished jobs are kept for ttl seconds after they
+    complete so clients can pick up the result, then dropped.
+
+    submit_for() ties a job to an owner (a user, a client address) and
+    refuses more than max_per_owner unfinished jobs per owner, so one client
+    can't fill the queue. Time spent waiting in the queue and running is
+    recorded per queue name in the metrics.
+    """
+
+    def __init__(self, max_workers=2, ttl=600, name='jobs', max_per_owner=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.max_per_owner = max_per_owner
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        job = self._add_job()
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job['id']
+
+    def submit_with_progress(self, fn, *args, **kwargs):
+        """
+        Like submit(), but fn gets a progress(value) callback as its first
+        argument. The latest value is returned as 'progress' by get() while
+        the job runs, e.g. the part of a result that is already usable.
+        """
+        job = self._add_job()
+
+        def progress(value):
+            job['progress'] = value
+
+        self.executor.submit(self._run, job, fn, (progress,) + args, kwargs)
+        return job['id']
+
+    def submit_for(self, owner, fn, *args, **kwargs):
+        """submit() on behalf of owner; raises JobLimitExceeded when owner is at max_per_owner"""
+        job = self._add_job(owner)
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job['id']
+
+    def _add_job(self, owner=None):
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'owner': owner,
+            'status': PENDING,
+            'result': None,
+            'error': None,
+            'progress': None,
+            'created': time.time(),
+            'finished': None,
+            'event': threading.Event()
+        }
+        with self.lock:
+            self._expire()
+            if owner is not None and self.max_per_owner:
+                active = sum(1 for other in self.jobs.values()
+                             if other['owner'] == owner and other['status'] in (PENDING, RUNNING))
+                if active >= self.max_per_owner:
+                    self.rejected += 1
+                    raise JobLimitExceeded(f"{owner} already has {active} {self.name} jobs in progress")
+            job['sequence'] = self.submitted
+            self.jobs[job_id] = job
+            self.submitted += 1
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job['status'] = RUNNING
+        job['started'] = time.time()
+        metrics.observe('job_wait_seconds', job['started'] - job['created'],
+                        help="Time jobs spent queued before a worker picked them up", queue=self.name)
+        try:
+            job['result'] = fn(*args, **kwargs)
+            job['status'] = DONE
+        except Exception as e:
+            print(f"Error in background job {job['id']}: {str(e)}")
+            job['error'] = str(e)
+            job['status'] = FAILED
+        job['finished'] = time.time()
+        metrics.observe('job_run_seconds', job['finished'] - job['started'],
+                        help="Time jobs spent running", queue=self.name, status=job['status'])
+        with self.lock:
+            if job['status'] == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+        job['event'].set()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job['finished'] and job['finished'] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def get(self, job_id, wait=0):
+        """
+        Snapshot of a job ({'id', 'status', 'result', 'error', ...}) or None if
+        it is unknown or expired. With wait > 0, block up to that many seconds
+        for the job to finish. Pending jobs also get 'position', the number of
+        jobs queued ahead of them.
+        """
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if wait > 0:
+            job['event'].wait(wait)
+        snapshot = {key: value for key, value in job.items() if key != 'event'}
+        if snapshot['status'] == PENDING:
+            with self.lock:
+                snapshot['position'] = sum(1 for other in self.jobs.values()
+                                           if other['status'] == PENDING and other['sequence'] < job['sequence'])
+        return snapshot
+
+    def stats(self):
+        with self.lock:
+            self._expire()
+            pending = sum(1 for job in self.jobs.values() if job['status'] == PENDING)
+            running = sum(1 for job in self.jobs.values() if job['status'] == RUNNING)
+            return {
+                'jobs': len(self.jobs),
+                'active': pending + running,
+                'pending': pending,
+                'running': running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
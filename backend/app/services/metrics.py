@@ -0,0 +1,186 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for quantiles"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self):
+        samples = sorted(self.recent)
+        if not samples:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms, rendered in the Prometheus
+    text format.
+
+    Histograms keep cumulative buckets (for histogram_quantile() in
+    Prometheus) and the last `window` samples, from which p50/p95/p99 are
+    exported directly as <name>_quantile. Each gunicorn worker has its own
+    registry, so scrape the workers individually or aggregate in Prometheus.
+    """
+
+    def __init__(self, namespace='ptrs', window=1024):
+        self.namespace = namespace
+        self.window = window
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def _key(self, name, labels):
+        return f"{self.namespace}_{name}", tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, help=None, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if help:
+                self.help[key[0]] = help
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, help=None, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if help:
+                self.help[key[0]] = help
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(window=self.window)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a block as one stage; failures are also counted per stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('stage_errors_total', help="Stages that raised an exception", stage=stage, **labels)
+            raise
+        finally:
+            self.observe('stage_duration_seconds', time.perf_counter() - start,
+                         help="Time spent in each request stage", stage=stage, **labels)
+
+    def timed(self, stage):
+        """Decorator form of span()"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{series: {'count', 'mean', 'p50', 'p95', 'p99'}} in seconds, for JSON stats"""
+        with self.lock:
+            result = {}
+            for (name, labels), histogram in self.histograms.items():
+                quantiles = histogram.quantiles()
+                series = name + format_labels(labels)
+                result[series] = {
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                    'p50': quantiles[0.5],
+                    'p95': quantiles[0.95],
+                    'p99': quantiles[0.99]
+                }
+            return result
+
+    def render(self, gauges=None, counters=None):
+        """
+        Prometheus text exposition of all metrics. gauges maps
+        {name: value} or {name: [(labels, value), ...]} for point-in-time
+        values collected by the caller (cache sizes, queue depths, ...);
+        counters has the same shape for cumulative totals the caller keeps
+        itself (cache hits, jobs completed, ...), and its names should end
+        in _total.
+        """
+        lines = []
+        with self.lock:
+            by_name = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                by_name.setdefault(name, []).append((labels, value))
+            for name, samples in by_name.items():
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+            by_name = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                by_name.setdefault(name, []).append((labels, histogram))
+            for name, samples in by_name.items():
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in samples:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (('le', format_value(bound)),)
+                        lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+                lines.append(f"# HELP {name}_quantile Quantiles over the last {self.window} samples")
+                lines.append(f"# TYPE {name}_quantile gauge")
+                for labels, histogram in samples:
+                    for q, value in histogram.quantiles().items():
+                        quantile_labels = labels + (('quantile', str(q)),)
+                        lines.append(f"{name}_quantile{format_labels(quantile_labels)} {format_value(value)}")
+
+        for kind, collected in (('counter', counters), ('gauge', gauges)):
+            for name, values in (collected or {}).items():
+                name = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {name} {kind}")
+                if isinstance(values, list):
+                    for labels, value in values:
+                        lines.append(f"{name}{format_labels(sorted(labels.items()))} {format_value(value)}")
+                else:
+                    lines.append(f"{name} {format_value(values)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry shared by the routes and services
+metrics = Metrics()
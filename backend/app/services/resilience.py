@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was not attempted or could not finish in time"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class Deadline:
+    """
+    Time budget of one request. Every outbound call takes its timeout from
+    the budget that is left, capped per upstream, so a slow upstream can't
+    hold a worker longer than the request is allowed to take.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None):
+        """Seconds the next call may take; raises DeadlineExceeded when nothing is left"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:.0f}s exceeded")
+        return min(remaining, cap) if cap else remaining
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast with CircuitOpenError. Once reset_timeout seconds have passed it
+    is half-open: a single probe call is let through, and its outcome closes
+    the circuit again or re-opens it for another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv('BREAKER_FAILURES', 5))
+        self.reset_timeout = reset_timeout or float(os.getenv('BREAKER_RESET_SECONDS', 30))
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self):
+        """Whether a call may go out now; in half-open state only one probe may"""
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == CLOSED:
+                return True
+            # A probe that never reported back (e.g. it crashed) doesn't block the next one forever
+            now = time.monotonic()
+            if self.state == HALF_OPEN and (not self.probing or now - self.probe_started >= self.reset_timeout):
+                self.probing = True
+                self.probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker; any exception counts as a failure and is re-raised"""
+        self.check()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def is_available(self):
+        with self.lock:
+            return self.state != OPEN or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'trips': self.trips
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name):
+    """Process-wide breaker for one upstream, shared by every caller"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_stats():
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
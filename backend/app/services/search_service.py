@@ -1,107 +1,361 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from PyPDF2 import PdfReader
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+import hashlib
 import os
+import threading
+import time
+from .index_store import IndexStore, scan_sources
+from .pdf_extractor import PDFExtractor
+from .inverted_index import InvertedIndex, top_k_per_row
+from .bm25 import BM25Scorer
+from .incremental_index import IncrementalIndex
+from .cache import LRUCache, normalize_query
+from .reranker import Reranker
+from .chunk_store import ChunkStore
+from .chunking import Chunker
+from .context_packer import ContextPacker
+from .metrics import metrics
 import numpy as np
 
+SCORING_MODES = ('cosine', 'bm25', 'bm25+')
+# BM25 scores are unbounded, so the cosine cut-off only applies to cosine
+SIMILARITY_THRESHOLDS = {'cosine': 0.1, 'bm25': 0.0, 'bm25+': 0.0}
+
+def copy_result(result):
+    # Cached results are shared between requests, so callers get their own copy
+    return dict(result, sources=[dict(source) for source in result['sources']])
+
 class SearchService:
-    def __init__(self):
+    def __init__(self, course_materials_path="./data/course_materials", index_path="./data/search_index"):
         self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.documents = []
+        self.counter = CountVectorizer(stop_words='english')
+        self.documents = ChunkStore.from_documents([])
         self.vectors = None
+        self.term_counts = None
+        self.chunk_lengths = None
+        self.inverted_index = None
+        self.bm25 = None
+        self.source_names = []
+        self.source_ids = np.zeros(0, dtype=np.int32)
+        self.reranker = Reranker()
+        self.context_packer = ContextPacker()
+        self.source_priors = self.reranker.prior_table([])
+        # How many candidates per requested result are fetched before reranking
+        self.candidate_factor = int(os.getenv('SEARCH_CANDIDATE_FACTOR', 2))
+        # Default ranking; get_context can override it per request for A/B runs
+        self.scoring = os.getenv('SEARCH_SCORING', 'cosine').lower()
+        self.bm25_k1 = float(os.getenv('BM25_K1', 1.2))
+        self.bm25_b = float(os.getenv('BM25_B', 0.75))
+        self.bm25_plus_delta = float(os.getenv('BM25_PLUS_DELTA', 1.0))
+        self.course_materials_path = course_materials_path
+        self.index = IncrementalIndex()
+        self.index_version = None
+        # Everything a query reads, replaced as a whole by refresh(); see snapshot()
+        self.view = self.empty_view()
+        self.lock = threading.RLock()
+        # Results are tagged with index_version, so any index update invalidates them
+        self.query_cache = LRUCache(
+            max_entries=int(os.getenv('QUERY_CACHE_SIZE', 1024)),
+            ttl=float(os.getenv('QUERY_CACHE_TTL', 600))
+        )
+        self.chunker = Chunker()
+        # Chunks built with other chunker settings are stale, so the stored index is rebuilt
+        self.index_store = IndexStore(index_path, settings={'chunking': self.chunker.settings})
+        self.pdf_extractor = PDFExtractor()
         self.load_documents()
         
-    def read_pdf(self, file_path):
-        try:
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            return text
-        except Exception as e:
-            print(f"Error reading PDF {file_path}: {e}")
-            return ""
-
     def load_documents(self):
         print("\nStarting document loading...")
-        course_materials_path = "./data/course_materials"
+        course_materials_path = self.course_materials_path
         print(f"Looking for PDFs in: {os.path.abspath(course_materials_path)}")
-        
-        for root, _, files in os.walk(course_materials_path):
-            for file in files:
-                if file.endswith('.pdf'):
-                    file_path = os.path.join(root, file)
-                    print(f"\nProcessing PDF: {file}")
-                    content = self.read_pdf(file_path)
-                    if content:
-                        print(f"Successfully loaded {file} - Content length: {len(content)}")
-                        # Split content into smaller chunks
-                        chunks = [content[i:i+1000] for i in range(0, len(content), 800)]  # 200 words overlap
-                        for i, chunk in enumerate(chunks):
-                            self.documents.append({
-                                'content': chunk,
-                                'source': file,
-                                'path': file_path,
-                                'chunk_id': i
-                            })
-        
-        if self.documents:
-            print(f"\nTotal chunks created: {len(self.documents)}")
-            texts = [doc['content'] for doc in self.documents]
-            self.vectors = self.vectorizer.fit_transform(texts)
-            print("Vectors created successfully")
-    
-    def get_context(self, query, n_results=5):  # Increased n_results
-        if not self.documents or self.vectors is None:
+
+        start_time = time.perf_counter()
+        sources = scan_sources(course_materials_path)
+        if self.load_index():
+            changed, removed = self.index_store.diff_sources(sources)
+            if not changed and not removed:
+                self.touch_index(sources)
+                self.refresh()
+                elapsed_ms = (time.perf_counter() - start_time) * 1000
+                print(f"Loaded search index from {self.index_store.path} in {elapsed_ms:.1f} ms "
+                      f"({len(self.documents)} chunks)")
+                return
+            print(f"Search index out of date: {len(changed)} new or changed, {len(removed)} removed PDFs")
+        else:
+            print("Search index missing, building...")
+            changed, removed = [source['path'] for source in sources], []
+
+        self.update_sources(changed, removed)
+        self.refresh()
+        self.save_index(sources)
+
+    def sync_documents(self):
+        """Pick up PDFs added, changed or deleted since the index was last saved"""
+        sources = scan_sources(self.course_materials_path)
+        changed, removed = self.index_store.diff_sources(sources)
+        if changed or removed:
+            self.update_sources(changed, removed)
+            self.refresh()
+            self.save_index(sources)
+        else:
+            self.touch_index(sources)
+        return {'changed': changed, 'removed': removed}
+
+    def add_document(self, file_path):
+        """Index (or re-index) one PDF. Only that file is read and tokenized."""
+        self.update_sources([file_path], [])
+
+    def remove_document(self, file_path):
+        self.update_sources([], [file_path])
+
+    def update_sources(self, changed, removed):
+        extracted = self.pdf_extractor.extract(changed) if changed else []
+        with self.lock:
+            for file_path in removed:
+                self.index.remove_source(file_path)
+            for file_path, pages in zip(changed, extracted):
+                self.index.add_source(file_path, self.chunk_document(file_path, pages))
+
+    def chunk_document(self, file_path, pages):
+        file = os.path.basename(file_path)
+        print(f"\nProcessing PDF: {file}")
+        documents = []
+        if any(pages):
+            print(f"Successfully loaded {file} - Content length: {sum(len(page) for page in pages)}")
+            # Split along sentences into token-budgeted chunks that remember their pages
+            for chunk in self.chunker.chunk_pages(pages):
+                documents.append(dict(chunk, source=file, path=file_path))
+        return documents
+
+    def load_index(self):
+        index = self.index_store.load()
+        if index is None:
+            return False
+
+        with self.lock:
+            self.index.restore(index, sources=[entry['path'] for entry in index['manifest']['sources']])
+        return True
+
+    def save_index(self, sources):
+        try:
+            with self.lock:
+                # Only record sources the index really holds, so anything left out is picked up by the next sync
+                sources = [source for source in sources if source['path'] in self.index]
+                self.index_store.save(sources, self.index.materialize())
+            print(f"Search index saved to {self.index_store.path}")
+        except Exception as e:
+            print(f"Error saving search index: {e}")
+
+    def touch_index(self, sources):
+        # PDFs touched without a content change: store their new mtimes so they aren't hashed again
+        try:
+            if self.index_store.touch(sources):
+                print("Search index manifest updated with new file times")
+        except OSError as e:
+            print(f"Error updating search index manifest: {e}")
+
+    def empty_view(self):
+        return {
+            'version': None,
+            'vectorizer': self.vectorizer,
+            'counter': self.counter,
+            'documents': self.documents,
+            'vectors': None,
+            'source_ids': self.source_ids,
+            'source_priors': self.source_priors,
+            'inverted_index': None,
+            'bm25': None
+        }
+
+    def snapshot(self):
+        """
+        The current query-time view, after refresh(). A query reads everything
+        from one view, so an index update that lands meanwhile (sync_documents)
+        can't mix two versions of the index in one result.
+        """
+        self.refresh()
+        with self.lock:
+            return self.view
+
+    def refresh(self):
+        """
+        Bring the query-time view up to date with the incremental index. IDF and
+        the scorers are only recomputed when a source was added or removed.
+        """
+        with self.lock:
+            if self.index_version == self.index.version:
+                return
+            state = self.index.materialize()
+
+            vectorizer = TfidfVectorizer(stop_words='english')
+            vectorizer.vocabulary_ = state['vocabulary']
+            vectorizer.idf_ = state['idf']
+            counter = CountVectorizer(stop_words='english')
+            counter.vocabulary_ = state['vocabulary']
+
+            self.vectorizer = vectorizer
+            self.counter = counter
+            self.documents = state['documents']
+            self.vectors = state['vectors']
+            self.term_counts = state['term_counts']
+            self.chunk_lengths = state['chunk_lengths']
+            self.source_ids = self.documents.source_ids
+            self.source_names = self.documents.source_names
+            self.source_priors = self.reranker.prior_table(self.source_names)
+            if len(self.documents):
+                self.inverted_index = InvertedIndex(state['postings'])
+                self.bm25 = BM25Scorer(state['count_postings'], self.chunk_lengths)
+            else:
+                self.inverted_index = None
+                self.bm25 = None
+            self.index_version = state['version']
+            self.view = {
+                'version': self.index_version,
+                'vectorizer': self.vectorizer,
+                'counter': self.counter,
+                'documents': self.documents,
+                'vectors': self.vectors,
+                'source_ids': self.source_ids,
+                'source_priors': self.source_priors,
+                'inverted_index': self.inverted_index,
+                'bm25': self.bm25
+            }
+            print(f"Search index ready: {len(self.documents)} chunks, {len(state['vocabulary'])} terms, "
+                  f"{self.documents.nbytes / 1e6:.1f} MB chunk store")
+
+    def resolve_scoring(self, scoring=None):
+        scoring = (scoring or self.scoring).lower()
+        if scoring not in SCORING_MODES:
+            print(f"Unknown scoring mode '{scoring}', using '{self.scoring}'")
+            scoring = self.scoring
+        return scoring
+
+    def rank(self, query, k, scoring=None, k1=None, b=None, view=None):
+        """Return (chunk_indices, scores) of the k best chunks under the chosen scoring mode"""
+        scoring = self.resolve_scoring(scoring)
+        view = view or self.snapshot()
+
+        if scoring == 'cosine':
+            return view['inverted_index'].top_k(view['vectorizer'].transform([query]), k)
+
+        return view['bm25'].top_k(
+            view['counter'].transform([query]), k,
+            k1=self.bm25_k1 if k1 is None else k1,
+            b=self.bm25_b if b is None else b,
+            delta=self.bm25_plus_delta if scoring == 'bm25+' else 0.0
+        )
+
+    def rank_batch(self, queries, k, scoring=None, k1=None, b=None, view=None):
+        """
+        Rank many queries with a single sparse query×chunk product. Returns two
+        lists with one array of chunk indices and one of scores per query.
+        """
+        scoring = self.resolve_scoring(scoring)
+        view = view or self.snapshot()
+
+        if scoring == 'cosine':
+            scores = view['inverted_index'].score_batch(view['vectorizer'].transform(queries))
+        else:
+            scores = view['bm25'].score_batch(
+                view['counter'].transform(queries),
+                k1=self.bm25_k1 if k1 is None else k1,
+                b=self.bm25_b if b is None else b,
+                delta=self.bm25_plus_delta if scoring == 'bm25+' else 0.0
+            )
+        return top_k_per_row(scores, k)
+
+    def assemble_context(self, top_indices, top_scores, n_results, threshold, view=None):
+        view = view or self.snapshot()
+        chunk_indices, scores = self.reranker.rerank(
+            top_indices, top_scores, view['source_ids'], view['source_priors'], view['vectors'], n_results, threshold
+        )
+        documents = [view['documents'][idx] for idx in chunk_indices.tolist()]
+        # Identifies the exact chunks behind the context, e.g. for caching answers built on it
+        fingerprint = hashlib.sha1(np.asarray(chunk_indices, dtype=np.int64).tobytes()).hexdigest()
+        pieces, tokens = self.context_packer.pack(documents, scores.tolist())
+        return {
+            'context': self.context_packer.render(pieces),
+            'sources': [
+                {
+                    'filename': piece['source'],
+                    'similarity': piece['score'],
+                    'page_start': piece['page_start'],
+                    'page_end': piece['page_end']
+                }
+                for piece in pieces
+            ],
+            'tokens': tokens,
+            'fingerprint': fingerprint,
+            'index_version': view['version']
+        }
+
+    def get_context(self, query, n_results=5, scoring=None, k1=None, b=None):  # Increased n_results
+        view = self.snapshot()
+        if not len(view['documents']) or view['inverted_index'] is None:
             return {'context': "", 'sources': []}
             
         try:
-            # Get query vector
-            query_vector = self.vectorizer.transform([query])
-            
-            # Calculate similarities
-            similarities = cosine_similarity(query_vector, self.vectors)[0]
-            
-            # Get top results
-            top_indices = np.argsort(similarities)[-n_results*2:][::-1]  # Get more results initially
-            
-            context = ""
-            sources = []
-            seen_files = set()
-            
-            # First, prioritize files that match the topic
-            for idx in top_indices:
-                if similarities[idx] > 0.1:  # Similarity threshold
-                    doc = self.documents[idx]
-                    if "metabolism" in doc['source'].lower() and doc['source'] not in seen_files:
-                        context += f"\nFrom {doc['source']}:\n{doc['content']}\n"
-                        sources.append({
-                            'filename': doc['source'],
-                            'similarity': float(similarities[idx])
-                        })
-                        seen_files.add(doc['source'])
-            
-            # If we haven't found enough relevant sources, add other high-scoring documents
-            if len(sources) < n_results:
-                for idx in top_indices:
-                    if similarities[idx] > 0.1:  # Similarity threshold
-                        doc = self.documents[idx]
-                        if doc['source'] not in seen_files:
-                            context += f"\nFrom {doc['source']}:\n{doc['content']}\n"
-                            sources.append({
-                                'filename': doc['source'],
-                                'similarity': float(similarities[idx])
-                            })
-                            seen_files.add(doc['source'])
-                            if len(sources) >= n_results:
-                                break
-            
-            print(f"Found {len(sources)} relevant sources")
-            return {
-                'context': context.strip(),
-                'sources': sources
-            }
+            scoring = self.resolve_scoring(scoring)
+            cache_key = (normalize_query(query), n_results, scoring, k1, b)
+            version = view['version']
+            cached = self.query_cache.get(cache_key, version)
+            if cached is not None:
+                print(f"Query cache hit ({len(cached['sources'])} sources)")
+                return copy_result(cached)
+
+            # Score only chunks sharing a term with the query, keeping the best candidates for reranking
+            with metrics.span('search_rank', scoring=scoring):
+                top_indices, top_scores = self.rank(query, n_results * self.candidate_factor, scoring, k1, b, view)
+            with metrics.span('search_assemble'):
+                result = self.assemble_context(top_indices, top_scores, n_results, SIMILARITY_THRESHOLDS[scoring],
+                                               view)
+            print(f"Found {len(result['sources'])} relevant sources, context {result['tokens']['packed']} tokens "
+                  f"({result['tokens']['saved']} saved)")
+            self.query_cache.put(cache_key, result, version)
+            return copy_result(result)
             
         except Exception as e:
             print(f"Error in get_context: {str(e)}")
-            return {'context': "", 'sources': []}
\ No newline at end of file
+            return {'context': "", 'sources': []}
+
+    def get_context_batch(self, queries, n_results=5, scoring=None, k1=None, b=None):
+        """
+        Retrieve context for many queries at once, e.g. for offline evaluation or
+        cache warm-up. Cached queries are answered from the query cache; the rest
+        are scored together in one sparse product. Returns one
+        {'context', 'sources'} dict per query, in order.
+        """
+        view = self.snapshot()
+        if not len(view['documents']) or view['inverted_index'] is None:
+            return [{'context': "", 'sources': []} for _ in queries]
+
+        try:
+            scoring = self.resolve_scoring(scoring)
+            version = view['version']
+            keys = [(normalize_query(query), n_results, scoring, k1, b) for query in queries]
+            results = [self.query_cache.get(key, version) for key in keys]
+
+            pending = {}
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    pending.setdefault(key, []).append(i)
+
+            if pending:
+                positions = list(pending.values())
+                all_indices, all_scores = self.rank_batch(
+                    [queries[group[0]] for group in positions], n_results * self.candidate_factor,
+                    scoring, k1, b, view
+                )
+                for group, top_indices, top_scores in zip(positions, all_indices, all_scores):
+                    result = self.assemble_context(top_indices, top_scores, n_results,
+                                                   SIMILARITY_THRESHOLDS[scoring], view)
+                    self.query_cache.put(keys[group[0]], result, version)
+                    for i in group:
+                        results[i] = result
+
+            print(f"Retrieved context for {len(queries)} queries ({len(pending)} scored, "
+                  f"{len(queries) - sum(len(group) for group in pending.values())} cached)")
+            return [copy_result(result) for result in results]
+
+        except Exception as e:
+            print(f"Error in get_context_batch: {str(e)}")
+            return [{'context': "", 'sources': []} for _ in queries]
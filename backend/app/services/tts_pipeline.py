@@ -0,0 +1,287 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from .chunking import SENTENCE_BREAK, split_sentences
+from .resilience import DeadlineExceeded
+
+# Google TTS rejects inputs over 5000 bytes; stay below with some margin
+TTS_INPUT_LIMIT = 4800
+
+# Layer III bitrates (kbit/s) and sample rates by MPEG version
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+MP3_VERSIONS = {3: 1, 2: 2, 0: 2.5}
+
+
+def split_words(text, max_bytes):
+    """Cut an over-long sentence at word boundaries into pieces of at most max_bytes"""
+    piece = ""
+    for word in text.split():
+        candidate = f"{piece} {word}" if piece else word
+        if piece and len(candidate.encode('utf-8')) > max_bytes:
+            yield piece
+            candidate = word
+        piece = candidate
+    if piece:
+        yield piece
+
+
+def segment_text(text, segment_bytes=1500, first_segment_bytes=300, limit=TTS_INPUT_LIMIT):
+    """
+    Split text at sentence boundaries into segments for separate synthesis
+    calls. Sentences are packed greedily up to segment_bytes (UTF-8), except
+    the first segment, which is kept to first_segment_bytes so the start of
+    the answer is ready quickly. Sentences longer than segment_bytes are split
+    at word boundaries, and segment_bytes is capped at limit, the largest
+    input the TTS API accepts.
+    """
+    segment_bytes = min(segment_bytes, limit)
+    segments = []
+    current, current_bytes = [], 0
+    for start, end in split_sentences(text):
+        sentence = text[start:end].strip()
+        if not sentence:
+            continue
+        budget = min(first_segment_bytes, limit) if not segments else segment_bytes
+        for piece in split_words(sentence, segment_bytes):
+            size = len(piece.encode('utf-8'))
+            if current and current_bytes + 1 + size > budget:
+                segments.append(" ".join(current))
+                current, current_bytes = [], 0
+                budget = segment_bytes
+            current.append(piece)
+            current_bytes += size + (1 if current_bytes else 0)
+    if current:
+        segments.append(" ".join(current))
+    return segments
+
+
+def skip_id3(data):
+    """Offset of the first byte after a leading ID3v2 tag"""
+    if len(data) >= 10 and data[:3] == b'ID3':
+        # Syncsafe size: 7 bits per byte, plus a 10-byte footer when flagged
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return 10 + size + (10 if data[5] & 0x10 else 0)
+    return 0
+
+
+def frame_info(data, offset):
+    """(frame length, side info length) of the Layer III frame at offset, or None"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    version = MP3_VERSIONS.get((data[offset + 1] >> 3) & 3)
+    layer = (data[offset + 1] >> 1) & 3
+    bitrate_index = data[offset + 2] >> 4
+    rate_index = (data[offset + 2] >> 2) & 3
+    if version is None or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    padding = (data[offset + 2] >> 1) & 1
+    mono = (data[offset + 3] >> 6) == 3
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    length = (144 if version == 1 else 72) * bitrate // sample_rate + padding
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    return length, side_info
+
+
+def mp3_frames(data):
+    """
+    The audio frames of an MP3 file: without ID3v2/ID3v1 tags and without a
+    leading Xing/Info frame, whose frame count would be wrong once files are
+    joined. Data that doesn't parse as MP3 is returned unchanged.
+    """
+    start = skip_id3(data)
+    end = len(data) - 128 if len(data) >= 128 and data[-128:-125] == b'TAG' else len(data)
+    info = frame_info(data, start)
+    if info is None:
+        return data
+    length, side_info = info
+    tag_offset = start + 4 + side_info
+    if data[tag_offset:tag_offset + 4] in (b'Xing', b'Info'):
+        start += length
+    return data[start:end]
+
+
+def stitch_mp3(segments):
+    """Join MP3 segments frame by frame, without re-encoding"""
+    return b"".join(mp3_frames(segment) for segment in segments)
+
+
+class TTSPipeline:
+    """
+    Speech synthesis for whole answers.
+
+    The text is cut into sentence-aligned segments (segment_text), each
+    segment is synthesized by synthesize(segment, deadline=None) -> MP3 bytes
+    on a bounded thread pool shared by all requests, and the results are
+    stitched in order. Latency is then roughly that of the longest segment
+    instead of the whole answer, and no call exceeds the TTS input limit.
+    Caching happens in synthesize (see TTSService), per segment, so sentences
+    repeated across answers are synthesized once.
+    """
+
+    def __init__(self, synthesize, max_workers=None, segment_bytes=None, first_segment_bytes=None):
+        self.synthesize = synthesize
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('TTS_WORKERS', 4)),
+            thread_name_prefix='tts'
+        )
+        self.segment_bytes = segment_bytes or int(os.getenv('TTS_SEGMENT_BYTES', 1500))
+        self.first_segment_bytes = first_segment_bytes or int(os.getenv('TTS_FIRST_SEGMENT_BYTES', 300))
+
+    def segments(self, text):
+        return segment_text(text, self.segment_bytes, self.first_segment_bytes)
+
+    def submit(self, segment, deadline=None):
+        """Future for the MP3 of one segment; the call's timeout comes from deadline"""
+        return self.executor.submit(self.synthesize, segment, deadline=deadline)
+
+    def iter_segments(self, text, deadline=None):
+        """
+        Yield the MP3 of each segment in order, each as soon as it is ready,
+        so playback can start with the first one. All segments are submitted
+        up front; an error in any segment is raised when its turn comes, and
+        the remaining segments are cancelled.
+        """
+        return self._results(self.segments(text), deadline)
+
+    def _results(self, segments, deadline=None):
+        futures = [self.submit(segment, deadline) for segment in segments]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def synthesize_text(self, text, on_segment=None, deadline=None):
+        """
+        MP3 of the whole text. on_segment(index, count, audio) is called for
+        every segment in order as it becomes available.
+        """
+        segments = self.segments(text)
+        audio_segments = []
+        for index, audio in enumerate(self._results(segments, deadline)):
+            audio_segments.append(audio)
+            if on_segment:
+                on_segment(index, len(segments), audio)
+        return stitch_mp3(audio_segments)
+
+
+class SentenceBuffer:
+    """
+    Cuts text that arrives in pieces (e.g. an LLM token stream) into speakable
+    segments as soon as their sentences are complete. The first segment is
+    released after the first sentence; later ones once at least
+    min_segment_bytes of complete sentences have accumulated, so one-word
+    sentences don't each cost a synthesis call.
+    """
+
+    def __init__(self, segment_bytes=1500, min_segment_bytes=80):
+        self.segment_bytes = min(segment_bytes, TTS_INPUT_LIMIT)
+        self.min_segment_bytes = min_segment_bytes
+        self.buffer = ""
+        self.released = 0
+
+    def _release(self, text):
+        segments = segment_text(text, self.segment_bytes, self.segment_bytes)
+        self.released += len(segments)
+        return segments
+
+    def feed(self, delta):
+        """Segments completed by delta, in order (often none)"""
+        self.buffer += delta
+        end = None
+        for match in SENTENCE_BREAK.finditer(self.buffer):
+            end = match.end()
+        if end is not None:
+            complete = self.buffer[:end]
+            if complete.strip() and (not self.released or len(complete.encode('utf-8')) >= self.min_segment_bytes):
+                self.buffer = self.buffer[end:]
+                return self._release(complete)
+        if len(self.buffer.encode('utf-8')) > self.segment_bytes:
+            # No sentence end in sight: cut at the last space
+            cut = self.buffer.rfind(' ')
+            if cut > 0:
+                complete, self.buffer = self.buffer[:cut], self.buffer[cut + 1:]
+                return self._release(complete)
+        return []
+
+    def flush(self):
+        """Whatever is left once the text is complete"""
+        rest, self.buffer = self.buffer, ""
+        return self._release(rest) if rest.strip() else []
+
+
+class SpeechStream:
+    """
+    Speech for text that is still being generated. feed() queues every
+    segment the SentenceBuffer releases on the pipeline right away and
+    returns the (index, MP3) pairs that are ready, in order, without
+    blocking; finish() synthesizes the rest and yields the remaining pairs as
+    they complete, waiting no longer than the deadline allows. A synthesis
+    error or the deadline running out stops the stream: the error
+    (DeadlineExceeded for the latter) is kept in .error, pending segments are
+    cancelled and nothing more is returned.
+    """
+
+    def __init__(self, pipeline, min_segment_bytes=None, deadline=None):
+        self.pipeline = pipeline
+        self.deadline = deadline
+        self.sentences = SentenceBuffer(
+            pipeline.segment_bytes,
+            min_segment_bytes or int(os.getenv('TTS_STREAM_MIN_SEGMENT_BYTES', 80))
+        )
+        self.pending = deque()
+        self.segments = []
+        self.error = None
+
+    def _submit(self, segments):
+        if self.error is None:
+            self.pending.extend(self.pipeline.submit(segment, self.deadline) for segment in segments)
+
+    def _take(self):
+        future = self.pending.popleft()
+        try:
+            audio = future.result(timeout=max(self.deadline.remaining(), 0) if self.deadline else None)
+        except TimeoutError:
+            future.cancel()
+            self.error = DeadlineExceeded(f"Request deadline of {self.deadline.seconds:.0f}s exceeded")
+            self.cancel()
+            return None
+        except Exception as e:
+            self.error = e
+            self.cancel()
+            return None
+        self.segments.append(audio)
+        return len(self.segments) - 1, audio
+
+    def feed(self, delta):
+        self._submit(self.sentences.feed(delta))
+        ready = []
+        while self.pending and self.pending[0].done():
+            item = self._take()
+            if item is None:
+                break
+            ready.append(item)
+        return ready
+
+    def finish(self):
+        self._submit(self.sentences.flush())
+        while self.pending:
+            item = self._take()
+            if item is None:
+                return
+            yield item
+
+    def cancel(self):
+        while self.pending:
+            self.pending.popleft().cancel()
+
+    def audio(self):
+        """All segments returned so far as one MP3"""
+        return stitch_mp3(self.segments)
@@ -1,34 +1,135 @@
 from google.cloud import texttospeech
 import os
-import base64
+import threading
+from concurrent.futures import Future
+from .audio_cache import AudioCache
+from .metrics import metrics
+from .tts_pipeline import TTSPipeline
 
 class TTSService:
-    def __init__(self):
-        self.client = texttospeech.TextToSpeechClient()
-        
-    def generate_audio(self, text):
-        try:
-            synthesis_input = texttospeech.SynthesisInput(text=text)
-            
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="en-US",
-                ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
-            )
-            
-            audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3
-            )
-            
-            response = self.client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config
+    """
+    The one way the backend talks to Google TTS.
+
+    - Keeps a pool of pool_size clients, each with its own gRPC channel, and
+      hands them out round-robin, so concurrent synthesis calls don't queue on
+      one connection. Clients are thread-safe. The pool is created on first
+      use in each process, never at import: gRPC must not be started in the
+      gunicorn master (preload_app) before it forks the workers.
+    - Builds the voice and audio config once.
+    - Coalesces identical requests (single flight). While a text is being
+      synthesized, other callers asking for the same text wait for that call
+      instead of making their own.
+    - Reads and fills the disk audio cache, so a repeated text costs one file
+      read.
+
+    synthesize() handles one input of at most TTS_INPUT_LIMIT bytes;
+    synthesize_text() splits longer texts into sentence segments and
+    synthesizes them in parallel (TTSPipeline).
+    """
+
+    def __init__(self, pool_size=None, cache=None, language_code="en-US", gender="NEUTRAL", encoding="MP3",
+                 timeout=None):
+        self.pool_size = pool_size or int(os.getenv('TTS_CLIENT_POOL', 2))
+        self.timeout = timeout or float(os.getenv('TTS_TIMEOUT', 15))
+        self.cache = cache or AudioCache()
+        self.voice_key = (language_code, gender, encoding)
+        self.voice = texttospeech.VoiceSelectionParams(
+            language_code=language_code,
+            ssml_gender=getattr(texttospeech.SsmlVoiceGender, gender)
+        )
+        self.audio_config = texttospeech.AudioConfig(
+            audio_encoding=getattr(texttospeech.AudioEncoding, encoding)
+        )
+        self.lock = threading.Lock()
+        self.clients = None
+        self.pid = None
+        self.next_client = 0
+        self.in_flight = {}
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.pipeline = TTSPipeline(self.synthesize)
+
+    def cache_key(self, text):
+        return AudioCache.key(text, *self.voice_key)
+
+    def _client(self):
+        with self.lock:
+            if self.clients is None or self.pid != os.getpid():
+                self.clients = [texttospeech.TextToSpeechClient() for _ in range(self.pool_size)]
+                self.pid = os.getpid()
+            client = self.clients[self.next_client % len(self.clients)]
+            self.next_client += 1
+            return client
+
+    def _call(self, text, timeout):
+        with metrics.span('tts_upstream'):
+            response = self._client().synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text),
+                voice=self.voice,
+                audio_config=self.audio_config,
+                timeout=timeout or self.timeout
             )
-            
-            # Convert audio content to base64 for sending to frontend
-            audio_base64 = base64.b64encode(response.audio_content).decode('utf-8')
-            return audio_base64
-            
+        return response.audio_content
+
+    def synthesize(self, text, timeout=None, deadline=None):
+        """
+        MP3 bytes for text; raises when synthesis fails. With a deadline, the
+        call takes its timeout from the time that is left (capped at the TTS
+        timeout) and raises DeadlineExceeded once none is.
+        """
+        key = self.cache_key(text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            return audio
+        timeout = deadline.timeout(timeout or self.timeout) if deadline else timeout or self.timeout
+
+        with self.lock:
+            self.requests += 1
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = Future()
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            metrics.inc('tts_coalesced_total', help="TTS requests served by an identical call in flight")
+            return flight.result(timeout=timeout)
+
+        try:
+            audio = self._call(text, timeout)
+            flight.set_result(audio)
+            # Cache before leaving the in-flight table, so a caller arriving
+            # in between finds the file instead of calling upstream again
+            try:
+                self.cache.put(key, audio)
+            except OSError as e:
+                print(f"Error caching audio: {str(e)}")
         except Exception as e:
-            print(f"Error generating audio: {str(e)}")
-            return None
\ No newline at end of file
+            if not flight.done():
+                flight.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return audio
+
+    def synthesize_text(self, text, on_segment=None, deadline=None):
+        """MP3 bytes for a text of any length; see TTSPipeline.synthesize_text"""
+        audio = self.pipeline.synthesize_text(text, on_segment, deadline)
+        try:
+            self.cache.put(self.cache_key(text), audio)
+        except OSError as e:
+            print(f"Error caching audio: {str(e)}")
+        return audio
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clients': len(self.clients) if self.clients else 0,
+                'requests': self.requests,
+                'upstream_calls': self.upstream_calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.in_flight)
+            }
@@ -0,0 +1,41 @@
+import gc
+import os
+
+# Usage: gunicorn -c gunicorn.conf.py
+wsgi_app = 'wsgi:app'
+bind = os.getenv('BIND', '0.0.0.0:5000')
+
+# One worker process by default: audio and image jobs, the image store and the
+# per-user image cap live in the process that accepted the request, so polls
+# for /api/audio/<id>, /api/image-jobs/<id> and /api/images/<id> must reach
+# that same process. Requests mostly wait on upstream APIs, so threads (not
+# processes) provide the concurrency; only raise WEB_CONCURRENCY behind a
+# load balancer with sticky sessions.
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# Load the app (and the search index) once in the master; forked workers share
+# its memory copy-on-write instead of each building their own
+preload_app = True
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def when_ready(server):
+    # Objects built during preload live as long as the process. Moving them to
+    # the permanent generation keeps the workers' garbage collector from
+    # writing to (and so un-sharing) the pages they sit on.
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Froze {gc.get_freeze_count()} preloaded objects before forking workers")
+    if server.cfg.workers > 1:
+        server.log.warning(
+            f"{server.cfg.workers} workers: audio/image job ids only resolve in the worker that created them, "
+            "so clients need sticky sessions"
+        )
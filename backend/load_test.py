@@ -0,0 +1,80 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+
+import requests
+
+
+def run_load(url, payload=None, concurrency=8, duration=10.0):
+    """
+    Send requests from `concurrency` threads for `duration` seconds (POST with
+    a JSON payload, GET without). Returns throughput and latency percentiles.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if payload is None:
+                    response = session.get(url, timeout=30)
+                else:
+                    response = session.post(url, json=payload, timeout=30)
+                response.content
+                if response.status_code >= 400:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': len(latencies) / elapsed,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure requests/sec of a running backend")
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/chat')
+    parser.add_argument('--message', default='hi', help="chat message to send (ignored with --get)")
+    parser.add_argument('--get', action='store_true', help="send GET requests without a body")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    payload = None if args.get else {'message': args.message}
+    result = run_load(args.url, payload, args.concurrency, args.duration)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
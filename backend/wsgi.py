@@ -0,0 +1,5 @@
+from app import create_app
+
+# Importing the app builds every service, including the search index. Under
+# gunicorn (preload_app) this happens once in the master, before workers fork.
+app = create_app()
@@ -1,11 +1,18 @@
 import React, { useState, useRef, useEffect } from "react";
 
+// Background jobs are polled with short requests; a waiting poll would hold a server thread
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 const ChatContainer = () => {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [isGeneratingImage, setIsGeneratingImage] = useState(false);
   const messagesEndRef = useRef(null);
+  // The server keeps the conversation history under this id
+  const sessionIdRef = useRef(null);
+  // Streamed speech segments waiting to be played, in order
+  const playbackRef = useRef({ queue: [], playing: false });
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -15,6 +22,62 @@ const ChatContainer = () => {
     scrollToBottom();
   }, [messages]);
 
+  const updateMessage = (id, fields) => {
+    setMessages((prev) =>
+      prev.map((message) => (message.id === id ? { ...message, ...fields } : message))
+    );
+  };
+
+  const decodeAudio = (audioBase64) => {
+    const bytes = Uint8Array.from(atob(audioBase64), (c) => c.charCodeAt(0));
+    return new Blob([bytes], { type: "audio/mpeg" });
+  };
+
+  const playNextSegment = () => {
+    const playback = playbackRef.current;
+    const segment = playback.queue.shift();
+    if (!segment) {
+      playback.playing = false;
+      return;
+    }
+    playback.playing = true;
+    const url = URL.createObjectURL(segment);
+    const audio = new Audio(url);
+    const next = () => {
+      URL.revokeObjectURL(url);
+      playNextSegment();
+    };
+    audio.addEventListener("ended", next);
+    audio.play().catch(next);
+  };
+
+  const enqueueSegment = (segment) => {
+    playbackRef.current.queue.push(segment);
+    if (!playbackRef.current.playing) playNextSegment();
+  };
+
+  // Speech is synthesized after the answer; poll every second until it is ready
+  const fetchAudio = async (audioId, messageId) => {
+    try {
+      for (let attempt = 0; attempt < 60; attempt++) {
+        const response = await fetch(
+          `http://127.0.0.1:5000/api/audio/${audioId}`
+        );
+        if (response.status === 202) {
+          await sleep(1000);
+          continue;
+        }
+        const data = await response.json();
+        if (response.ok && data.url) {
+          updateMessage(messageId, { audio: `http://127.0.0.1:5000${data.url}` });
+        }
+        return;
+      }
+    } catch (error) {
+      console.error("Audio error:", error);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!inputMessage.trim() || isLoading) return;
@@ -29,35 +92,83 @@ const ChatContainer = () => {
       setMessages((prev) => [...prev, userMessage]);
       setInputMessage("");
 
-      const response = await fetch("http://127.0.0.1:5000/api/chat", {
+      const response = await fetch("http://127.0.0.1:5000/api/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          Accept: "text/event-stream",
         },
         body: JSON.stringify({
           message: inputMessage,
           audio_requested: true,
+          // Speak each sentence as soon as it is generated
+          stream_audio: true,
+          session_id: sessionIdRef.current,
         }),
       });
 
-      const data = await response.json();
-      console.log("Response data:", data); // Debug log
-
       if (!response.ok) {
-        throw new Error(data.error || "Failed to get response");
+        throw new Error("Failed to get response");
       }
 
+      // Show the answer while it is generated, then fill in the final fields
       const assistantMessage = {
+        id: `assistant-${Date.now()}`,
         type: "assistant",
-        content: data.message,
-        sources: data.sources,
-        used_context: data.used_context,
-        context_preview: data.context_preview,
-        is_course_related: data.is_course_related,
-        audio: data.audio,
+        content: "",
         timestamp: new Date().toISOString(),
       };
       setMessages((prev) => [...prev, assistantMessage]);
+      const updateAssistant = (fields) => updateMessage(assistantMessage.id, fields);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let content = "";
+      const audioSegments = [];
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+
+          if (event === "sources") {
+            sessionIdRef.current = data.session_id;
+          } else if (event === "token") {
+            content += data.delta;
+            updateAssistant({ content });
+          } else if (event === "audio") {
+            const segment = decodeAudio(data.audio);
+            audioSegments.push(segment);
+            enqueueSegment(segment);
+          } else if (event === "done") {
+            console.log("Response data:", data); // Debug log
+            updateAssistant({
+              content: data.message,
+              sources: data.sources,
+              used_context: data.used_context,
+              context_preview: data.context_preview,
+              is_course_related: data.is_course_related,
+            });
+            if (audioSegments.length) {
+              // Keep the whole answer for replay
+              const audio = new Blob(audioSegments, { type: "audio/mpeg" });
+              updateAssistant({ audio: URL.createObjectURL(audio) });
+            } else if (data.audio_id) {
+              fetchAudio(data.audio_id, assistantMessage.id);
+            }
+          } else if (event === "error") {
+            throw new Error(data.error || "Failed to get response");
+          }
+        }
+      }
     } catch (error) {
       console.error("Chat error:", error);
       const errorMessage = {
@@ -90,12 +201,23 @@ const ChatContainer = () => {
         body: JSON.stringify({ prompt }),
       });
 
-      const data = await response.json();
-      if (data.success && data.image) {
+      let data = await response.json();
+      if (response.status !== 202) {
+        throw new Error(data.error || "Failed to queue image");
+      }
+      // Generation runs as a background job; poll every 2 s until it is done
+      const jobUrl = `http://127.0.0.1:5000${data.status_url}`;
+      for (let attempt = 0; attempt < 90; attempt++) {
+        const jobResponse = await fetch(jobUrl);
+        data = await jobResponse.json();
+        if (jobResponse.status !== 202) break;
+        await sleep(2000);
+      }
+      if (data.success && data.image_url) {
         const assistantMessage = {
           type: "assistant",
           content: `Here's an anatomical illustration based on your request. This image shows ${prompt}. The illustration includes detailed labeling and anatomical structures commonly used in medical education.`,
-          image: data.image,
+          image: `http://127.0.0.1:5000${data.image_url}`,
           timestamp: new Date().toISOString(),
         };
         setMessages((prev) => [...prev, assistantMessage]);
@@ -118,15 +240,15 @@ const ChatContainer = () => {
     const [showResume, setShowResume] = useState(false);
     const audioRef = useRef(null);
 
-    const toggleAudio = (audioBase64) => {
-      if (!audioBase64) {
+    const toggleAudio = (audioUrl) => {
+      if (!audioUrl) {
         console.log("No audio data available");
         return;
       }
 
       try {
         if (!audioRef.current) {
-          audioRef.current = new Audio(`data:audio/mp3;base64,${audioBase64}`);
+          audioRef.current = new Audio(audioUrl);
 
           // Add event listeners
           audioRef.current.addEventListener("ended", () => {
@@ -203,7 +325,7 @@ const ChatContainer = () => {
             {message.image && (
               <div className="mt-2">
                 <img
-                  src={`data:image/png;base64,${message.image}`}
+                  src={message.image}
                   alt="Generated illustration"
                   className="rounded-lg max-w-full"
                 />